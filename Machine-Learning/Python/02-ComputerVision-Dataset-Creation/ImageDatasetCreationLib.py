@@ -3,10 +3,12 @@
 
 # Imports
 import os, tarfile, glob, shutil, cv2, h5py
+from collections import deque
 from pathlib import Path
 from matplotlib import pyplot as plt
 import numpy as np
 from sklearn.model_selection import train_test_split
+from concurrent.futures import ProcessPoolExecutor
 
 # Define settings for use below
 settings = {
@@ -176,6 +178,19 @@ def displayImages(numberToShow, imagePath):
 
     return
 
+# Reduce the longer side of an image to the same dimension as the shorter side while keeping the image centered
+def squareImage(image):
+    if image.shape[0] > image.shape[1]:
+        dimDiff = round((image.shape[0]-image.shape[1])/2, 0)
+        cropRange =  range(int(dimDiff), int(image.shape[0]-dimDiff))
+        image = image[cropRange, 1:image.shape[1]]
+    elif image.shape[0] < image.shape[1]:
+        dimDiff = round((image.shape[1]-image.shape[0])/2, 0)
+        cropRange =  range(int(dimDiff), int(image.shape[1]-dimDiff))
+        image = image[1:image.shape[0], cropRange]
+
+    return image
+
 # Alter the aspect ratio of some number of images into a square shape
 def squareImages(inputDir, outputDir, numberToProcess):
     print("Starting to square images...")
@@ -207,15 +222,7 @@ def squareImages(inputDir, outputDir, numberToProcess):
             
         #image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         images.append(filename)
-        
-        if image.shape[0] > image.shape[1]:
-            dimDiff = round((image.shape[0]-image.shape[1])/2, 0)
-            cropRange =  range(int(dimDiff), int(image.shape[0]-dimDiff))
-            image = image[cropRange, 1:image.shape[1]]
-        elif image.shape[0] < image.shape[1]:
-            dimDiff = round((image.shape[1]-image.shape[0])/2, 0)
-            cropRange =  range(int(dimDiff), int(image.shape[1]-dimDiff))
-            image = image[1:image.shape[0], cropRange]    
+        image = squareImage(image)
 
         # Save the modified image to disk
         cv2.imwrite(os.path.join(outputDir, Path(filename).name), image)
@@ -302,16 +309,152 @@ def flattenImages(features, images):
     return dataSet
 
 
+# Flatten a list of images into a chunked (features, N) dataset 'blockSize' images at a time
+# Only one block of flattened images is held in memory at once
+def writeFlattenedImages(archive, key, features, images, blockSize = 256, compression = None, compressionLevel = None):
+    blockSize = max(1, min(blockSize, len(images)))
+    dset = archive.create_dataset(key, shape=(features, len(images)), dtype=np.float64,
+                                  chunks=(features, blockSize), compression=compression,
+                                  compression_opts=compressionLevel if compression == "gzip" else None)
+
+    for start in range(0, len(images), blockSize):
+        block = images[start:start + blockSize]
+        dset[:, start:start + len(block)] = flattenImages(features, block)
+
+    return dset
+
+# Square, resize, and flatten a single image file in memory; returns None if the image can't be read
+# The intermediate images are only written to disk when 'squareDir' and/or 'resizeDir' are given
+def processImage(filename, newImageSize, squareDir = None, resizeDir = None):
+    image = cv2.imread(filename, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+
+    image = squareImage(image)
+    if squareDir is not None:
+        cv2.imwrite(os.path.join(squareDir, Path(filename).name), image)
+
+    image = cv2.resize(image, (newImageSize, newImageSize))
+    if resizeDir is not None:
+        cv2.imwrite(os.path.join(resizeDir, Path(filename).name), image)
+
+    return image.flatten() / 255
+
+# Process pool task; square, resize, and flatten a block of image files with processImage()
+# Returns the (features, n) block of the readable images and a boolean mask of the files that could be read
+def processImageBlock(files, newImageSize, squareDir = None, resizeDir = None):
+    block = np.zeros((newImageSize * newImageSize * 3, len(files)))
+    readable = np.ones(len(files), dtype=bool)
+
+    for i, filename in enumerate(files):
+        image = processImage(filename, newImageSize, squareDir, resizeDir)
+        if image is None:
+            readable[i] = False
+        else:
+            block[:, i] = image
+
+    return block[:, readable], readable
+
+# Square, resize, and flatten a list of image files 'blockSize' images at a time, without the JPEG round trips
+# between the stages; yields (block, readable) pairs from processImageBlock() in file order
+# Set 'workers' to process the blocks in a pool of processes; at most 2 blocks per worker are in flight at once, so
+# only a few blocks are ever held in memory
+def iterProcessedImages(files, newImageSize, workers = None, squareDir = None, resizeDir = None, blockSize = 256):
+    # Create the intermediate image output directories if we were asked to keep them
+    for outputDir in (squareDir, resizeDir):
+        if outputDir is not None:
+            os.makedirs(os.path.join(os.getcwd(), outputDir), exist_ok=True)
+
+    blocks = [files[start:start + blockSize] for start in range(0, len(files), blockSize)]
+
+    if workers is None or workers <= 1:
+        for block in blocks:
+            yield processImageBlock(block, newImageSize, squareDir, resizeDir)
+        return
+
+    pending = deque()
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        for block in blocks:
+            if len(pending) == 2 * workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(processImageBlock, block, newImageSize, squareDir, resizeDir))
+
+        while pending:
+            yield pending.popleft().result()
+
+# Square, resize, and flatten a list of image files in one pass, without the JPEG round trips between the stages
+# Returns the (features, N) data set and a boolean mask of the files that could be read (skipped files get no column)
+# Set 'workers' to process the images in a pool of processes
+# The whole data set is held in memory; use writeProcessedImages() to stream the images into an archive instead
+def processImages(files, newImageSize, workers = None, squareDir = None, resizeDir = None, blockSize = 256):
+    print("Starting to process images...")
+
+    blocks, masks = [np.zeros((newImageSize * newImageSize * 3, 0))], [np.ones(0, dtype=bool)]
+    for block, readable in iterProcessedImages(files, newImageSize, workers, squareDir, resizeDir, blockSize):
+        blocks.append(block)
+        masks.append(readable)
+
+    print("Finished processing images!")
+    return np.concatenate(blocks, axis=1), np.concatenate(masks)
+
+# Square, resize, and flatten a list of image files straight into a chunked (features, N) dataset, using the same
+# layout as writeFlattenedImages(); only a few blocks of 'blockSize' images are held in memory at once
+# The dataset grows as the blocks are written, since images that can't be read get no column
+# Returns a boolean mask of the files that could be read
+def writeProcessedImages(archive, key, files, newImageSize, workers = None, blockSize = 256, compression = None,
+                         compressionLevel = None, squareDir = None, resizeDir = None):
+    features = newImageSize * newImageSize * 3
+    blockSize = max(1, min(blockSize, len(files)))
+    dset = archive.create_dataset(key, shape=(features, 0), maxshape=(features, None), dtype=np.float64,
+                                  chunks=(features, blockSize), compression=compression,
+                                  compression_opts=compressionLevel if compression == "gzip" else None)
+    masks = [np.ones(0, dtype=bool)]
+
+    for block, readable in iterProcessedImages(files, newImageSize, workers, squareDir, resizeDir, blockSize):
+        start = dset.shape[1]
+        dset.resize(start + block.shape[1], axis = 1)
+        dset[:, start:] = block
+        masks.append(readable)
+
+    return np.concatenate(masks)
+
+# Write the train and test labels and images to a HDF5 container straight from the source image files
+# Uses writeProcessedImages() in place of the squareImages() -> resizeImages() -> flattenImages() disk round trips
+def createArchiveFromSource(outputFile, trainLabels, testLabels, trainImages, testImages, newImageSize = 64,
+                            workers = None, blockSize = 256, compression = None, compressionLevel = None):
+    print("Creating HDF5 archive file...\n")
+
+    # Create the HDF5 container, dropping the labels of any images that couldn't be read
+    with h5py.File(outputFile, "w") as archive:
+        trainReadable = writeProcessedImages(archive, "trainImages", trainImages, newImageSize, workers, blockSize,
+                                             compression, compressionLevel)
+        testReadable = writeProcessedImages(archive, "testImages", testImages, newImageSize, workers, blockSize,
+                                            compression, compressionLevel)
+        archive.create_dataset("trainLabels", data=np.asarray(trainLabels)[trainReadable])
+        archive.create_dataset("testLabels", data=np.asarray(testLabels)[testReadable])
+        archive.close()
+
+    # Check the size on disk
+    print("Archive created.\n")
+    sizeOnDiskKB = round(os.path.getsize(outputFile) / 1024, 1)
+    sizeOnDiskMB = round(sizeOnDiskKB / 1024, 1)
+    print(str(outputFile) + " written to disk.  File size: " + str(sizeOnDiskKB) + "(kb) / " + str(sizeOnDiskMB) + "(mb)")
+
+    return archive
+
 # Write the train and test labels and images to a HDF5 container
-def createArchive(outputFile, trainLabels, testLabels, trainImages, testImages, features = 12288):
+# The images are flattened and written in blocks of 'blockSize' images; 'compression' may be None, "lzf", or "gzip"
+# ('compressionLevel' 0-9 applies to gzip only)
+def createArchive(outputFile, trainLabels, testLabels, trainImages, testImages, features = 12288,
+                  blockSize = 256, compression = None, compressionLevel = None):
     print("Creating HDF5 archive file...\n")
 
     # Create the HDF5 container and add the sample data we've created
     with h5py.File(outputFile, "w") as archive:
         archive.create_dataset("trainLabels", data=trainLabels)
         archive.create_dataset("testLabels", data=testLabels)
-        archive.create_dataset("trainImages", data=flattenImages(features, trainImages))
-        archive.create_dataset("testImages", data=flattenImages(features, testImages))
+        writeFlattenedImages(archive, "trainImages", features, trainImages, blockSize, compression, compressionLevel)
+        writeFlattenedImages(archive, "testImages", features, testImages, blockSize, compression, compressionLevel)
         archive.close()
 
     # Check the size on disk
@@ -5,12 +5,15 @@
 #%pylab
 
 # Imports
-import os, tarfile, glob, shutil, h5py
+import os, io, tarfile, glob, shutil, h5py
+from collections import deque
 from pathlib import Path
 from matplotlib import pyplot as plt
 import numpy as np
 from sklearn.model_selection import train_test_split
+from concurrent.futures import ProcessPoolExecutor
 import PIL
+import PIL.Image
 
 # Define settings for use below
 settings = {
@@ -26,6 +29,9 @@ settings = {
     "resizeDim" : 64
 }
 
+# Object image categories we don't want in our final data set
+skipCategories = ['BACKGROUND_Google', 'cougar_body', 'cougar_face', 'dalmatian', 'garfield', 'Leopards', 'snoopy', 'wild_cat']
+
 # Clean up any previous files and directories
 def clean(settings):
     print("Cleaning...\n")
@@ -77,11 +83,93 @@ def unpack(archiveDirectory, archiveFile, outputDirectory, extractDirName):
 
     return output, extractedPath
 
+# Staging file name for a pet image archive member, or None if it isn't a cat
+# Look at first letter in file name; upper == cat && lower == dog
+def petImageName(memberName):
+    name = Path(memberName).name
+    return name if name[0].isupper() else None
+
+# Staging file name for an object image archive member, or None if it's in a category we skip
+def objectImageName(memberName):
+    parts = Path(memberName).parts
+    if parts[-2] in skipCategories:
+        return None
+    return parts[-2] + "-" + parts[-1]
+
+# Iterate over the .jpg members under 'extractDirName' in a single streaming pass over an archive
+# Yields (stagingName, fileObject) for each member that 'nameFor' gives a staging name; nothing is written to disk
+def iterArchiveImages(archiveDirectory, archiveFile, extractDirName, nameFor):
+    archive = os.path.join(os.getcwd(), archiveDirectory, archiveFile)
+
+    with tarfile.open(archive, 'r|gz') as tar:
+        for member in tar:
+            path = Path(member.name)
+            if not member.isfile() or path.suffix != '.jpg' or path.parts[0] != extractDirName:
+                continue
+            name = nameFor(member.name)
+            if name is None:
+                continue
+            yield name, tar.extractfile(member)
+
+# Extract only the wanted images from an archive straight into a staging directory
+def unpackStreaming(archiveDirectory, archiveFile, outputDirectory, extractDirName, nameFor):
+    # Create the staging directory
+    output = os.path.join(os.getcwd(), outputDirectory)
+    os.makedirs(output, exist_ok=True)
+
+    count = 0
+    for name, source in iterArchiveImages(archiveDirectory, archiveFile, extractDirName, nameFor):
+        with open(os.path.join(output, name), 'wb') as target:
+            shutil.copyfileobj(source, target)
+        count += 1
+
+    return output, count
+
+# Decode the wanted images of an archive straight into (names, (n, dim, dim, 3) uint8 block) pairs
+# The blocks can be appended to an ArchiveWriter or stacked into a single data set array
+# 'draft' turns on reduced scale JPEG decoding (see readImage())
+def decodeArchiveImages(archiveDirectory, archiveFile, extractDirName, nameFor, dim = 128, blockSize = 64,
+                        draft = False):
+    names = []
+    block = np.empty((blockSize, dim, dim, 3), dtype=np.uint8)
+
+    for name, source in iterArchiveImages(archiveDirectory, archiveFile, extractDirName, nameFor):
+        try:
+            block[len(names)] = readImage(io.BytesIO(source.read()), dim, draft)
+        except OSError:
+            # Skip any images PIL can't decode
+            continue
+        names.append(name)
+        if len(names) == blockSize:
+            yield names, block.copy()
+            names = []
+
+    if names:
+        yield names, block[:len(names)].copy()
+
 # Extract the image archives and move the source image files into a staging area
-def unpackImageArchives(settings):
+# Set 'streaming' to read each archive once and extract only the cat and kept object images into the staging area
+def unpackImageArchives(settings, streaming = False):
     # Init counters
     catCount = 0
     objectCount = 0
+
+    if streaming:
+        print("Streaming the pet and object images into the staging areas...")
+        _, catCount = unpackStreaming(settings["archiveDirectory"], settings["petArchiveFile"],
+                                      settings["petOutputDirectory"], settings["petExtractDirName"], petImageName)
+        _, objectCount = unpackStreaming(settings["archiveDirectory"], settings["objectArchiveFile"],
+                                         settings["objectOutputDirectory"], settings["objectExtractDirName"],
+                                         objectImageName)
+
+        # We're done; provide some simple metrics
+        print("\nDone!\n")
+        print("Total files sorted:" + str(catCount + objectCount))
+        print("Total cats:" + str(catCount))
+        print("Total objects:" + str(objectCount))
+        print("\n")
+
+        return catCount, objectCount
     
     # Unpack the cat images
     print("Unpacking and sorting the pet images...")
@@ -121,7 +209,7 @@ def unpackImageArchives(settings):
     # Define what kind of images we want to iterate over
     imageFilter = os.path.join(extractedPath, '**', '*.jpg')
     # Define list of object images to skip
-    skip = ['BACKGROUND_Google', 'cougar_body', 'cougar_face', 'dalmatian', 'garfield', 'Leopards', 'snoopy', 'wild_cat']
+    skip = skipCategories
 
     # Move the image files from sub folders into a main area for later processing
     for filename in glob.iglob(imageFilter, recursive=True):
@@ -194,16 +282,70 @@ def createSample(yesDir, noDir, numYes, numNo, percentTest, randomState = 10):
         
     return trainFiles, testFiles, trainLabels, testLabels
 
-# Read image(s) into an Numpy array and return the collection of Numpy image arrays
-def makeImageData(files, dim = 128, debug = False):
-    dataSet = []
-
-    for f in files:
-        if debug: print(f)
-        img = PIL.Image.open(f).convert('RGB')
-        img = img.resize((dim, dim), PIL.Image.ANTIALIAS)
-        img = np.asarray(img)
-        dataSet.append(img)
+# Read a single image file and resize it into a (dim, dim, 3) Numpy image array
+# With 'draft' set, JPEGs are decoded at the smallest reduced scale that is still at least dim x dim
+def readImage(f, dim, draft = False):
+    img = PIL.Image.open(f)
+    if draft:
+        img.draft('RGB', (dim, dim))
+    img = img.convert('RGB')
+    img = img.resize((dim, dim), PIL.Image.LANCZOS)
+    return np.asarray(img)
+
+# Process pool task; read a block of image files into a (len(files), dim, dim, 3) array
+def readImageBlock(files, dim, draft = False):
+    block = np.empty((len(files), dim, dim, 3), dtype=np.uint8)
+    for i, f in enumerate(files):
+        block[i] = readImage(f, dim, draft)
+    return block
+
+# Yield (start, block) pairs of decoded images, in file order, 'blockSize' images at a time
+# Set 'workers' to decode the blocks in a pool of processes; 'draft' turns on reduced scale JPEG decoding (see
+# readImage()) and gives the same pixels whether or not a pool is used
+# At most 'window' blocks (default 2 per worker) are decoding or waiting to be consumed at any time, so a slow
+# consumer (e.g. a compressing ArchiveWriter) holds the pool back rather than letting decoded blocks pile up
+def iterImageBlocks(files, dim, workers = None, blockSize = 64, draft = False, window = None):
+    starts = range(0, len(files), blockSize)
+    blocks = [files[start:start + blockSize] for start in starts]
+
+    if workers is None or workers <= 1:
+        for start, block in zip(starts, blocks):
+            yield start, readImageBlock(block, dim, draft)
+        return
+
+    window = 2 * workers if window is None else max(1, window)
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        for start, block in zip(starts, blocks):
+            # Wait for the oldest block before submitting another once the window is full
+            if len(pending) == window:
+                oldest, future = pending.popleft()
+                yield oldest, future.result()
+            pending.append((start, executor.submit(readImageBlock, block, dim, draft)))
+
+        while pending:
+            oldest, future = pending.popleft()
+            yield oldest, future.result()
+
+# Read image(s) into a preallocated (N, dim, dim, 3) uint8 Numpy array
+# Set 'workers' to decode the images in a pool of processes, and 'draft' to use reduced scale JPEG decoding
+# Pass 'out' to write the images into an existing array-like container (e.g. a Numpy memmap or a HDF5 dataset)
+def makeImageData(files, dim = 128, debug = False, workers = None, out = None, blockSize = 64, draft = False):
+    if out is None:
+        dataSet = np.empty((len(files), dim, dim, 3), dtype=np.uint8)
+    else:
+        dataSet = out
+
+    if workers is None or workers <= 1:
+        for i, f in enumerate(files):
+            if debug: print(f)
+            dataSet[i] = readImage(f, dim, draft)
+    else:
+        # Write each decoded block into place as it comes back from the pool
+        for start, block in iterImageBlocks(files, dim, workers, blockSize, draft):
+            if debug: print("Images", start, "to", start + len(block) - 1)
+            dataSet[start:start + len(block)] = block
 
     if debug:
         print("len(dataSet):", len(dataSet))
@@ -225,10 +367,126 @@ def writeArch(outputFile, trainData, trainLabels, testData, testLabels):
     
     # Check the size on disk
     print("Archive created.\n")
+    printArchiveSize(outputFile)
+    
+    return
+
+# Report the size on disk of an archive file
+def printArchiveSize(outputFile):
     sizeOnDiskKB = round(os.path.getsize(outputFile) / 1024, 1)
     sizeOnDiskMB = round(sizeOnDiskKB / 1024, 1)
     print(str(outputFile) + " written to disk.  File size: " + str(sizeOnDiskKB) + "(kb) / " + str(sizeOnDiskMB) + "(mb)\n\n")
-    
+
+# Streaming writer for the trainData/trainLabels/testData/testLabels HDF5 archive layout
+# Image datasets are created empty, resizable, and chunked in blocks of 'chunkImages' images (so readers can pull
+# whole batches from a chunk), and then grow as blocks of images are appended
+# 'compression' may be None, "lzf", or "gzip" ('compressionLevel' 0-9 applies to gzip only)
+class ArchiveWriter:
+
+    def __init__(self, outputFile, dim, chunkImages = 64, compression = None, compressionLevel = None):
+        if compression not in (None, "lzf", "gzip"):
+            raise ValueError("compression must be None, 'lzf', or 'gzip'")
+
+        self.outputFile = outputFile
+        self.dim = dim
+        self.chunkImages = chunkImages
+        self.compression = compression
+        self.compressionOpts = compressionLevel if compression == "gzip" else None
+        self.archive = h5py.File(outputFile, "w")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Create an empty, resizable image dataset
+    def createImages(self, key):
+        return self.archive.create_dataset(
+            key,
+            shape = (0, self.dim, self.dim, 3),
+            maxshape = (None, self.dim, self.dim, 3),
+            dtype = np.uint8,
+            chunks = (self.chunkImages, self.dim, self.dim, 3),
+            compression = self.compression,
+            compression_opts = self.compressionOpts)
+
+    # Append a block of (n, dim, dim, 3) images to an image dataset
+    def append(self, key, block):
+        dset = self.archive[key] if key in self.archive else self.createImages(key)
+        start = dset.shape[0]
+        dset.resize(start + len(block), axis = 0)
+        dset[start:start + len(block)] = block
+
+    # Decode a list of image files and append them to an image dataset as the blocks are decoded
+    # Set 'workers' to have a pool of producer processes decode the blocks while this process writes them
+    # 'draft' turns on reduced scale JPEG decoding (see readImage())
+    def appendFiles(self, key, files, workers = None, debug = False, draft = False):
+        for start, block in iterImageBlocks(files, self.dim, workers, self.chunkImages, draft):
+            if debug: print(key + ": images", start, "to", start + len(block) - 1)
+            self.append(key, block)
+
+    # Write a full labels array
+    def writeLabels(self, key, labels):
+        self.archive.create_dataset(key, data = labels)
+
+    # Close the HDF5 container
+    def close(self):
+        self.archive.close()
+
+# Build the train and test archive straight from the image files without holding the image data in memory
+def writeArchStreaming(outputFile, trainFiles, trainLabels, testFiles, testLabels, dim = 128, workers = None,
+                       chunkImages = 64, compression = None, compressionLevel = None, debug = False,
+                       draft = False):
+    print("Creating HDF5 archive file...\n")
+
+    with ArchiveWriter(outputFile, dim, chunkImages, compression, compressionLevel) as archive:
+        archive.appendFiles("trainData", trainFiles, workers, debug, draft)
+        archive.writeLabels("trainLabels", trainLabels)
+        archive.appendFiles("testData", testFiles, workers, debug, draft)
+        archive.writeLabels("testLabels", testLabels)
+
+    # Check the size on disk
+    print("Archive created.\n")
+    printArchiveSize(outputFile)
+
+    return
+
+# Create a block of seeded synthetic (n, dim, dim, 3) images for the given labels
+# With 'separation' greater than zero the classes are learnable:  Yes (1) images are brighter in the red channel and
+# No (0) images are brighter in the blue channel by that many levels.  With zero the images are pure noise.
+def syntheticImages(rng, labels, dim = 64, separation = 40):
+    images = rng.integers(0, 256 - separation, size = (len(labels), dim, dim, 3), dtype = np.uint8)
+
+    if separation:
+        images[labels == 1, :, :, 0] += np.uint8(separation)
+        images[labels == 0, :, :, 2] += np.uint8(separation)
+
+    return images
+
+# Write a synthetic archive with the same keys and layout as writeArch() at any number of records and resolution
+# The images are generated and written a chunk at a time, so archives far larger than memory can be created
+# The labels are balanced at random; see syntheticImages() for 'separation'
+def writeSyntheticArch(outputFile, trainRecords, testRecords, dim = 64, separation = 40, seed = 10,
+                       chunkImages = 64, compression = None, compressionLevel = None, debug = False):
+    print("Creating synthetic HDF5 archive file...\n")
+    rng = np.random.default_rng(seed)
+
+    with ArchiveWriter(outputFile, dim, chunkImages, compression, compressionLevel) as archive:
+        for split, records in (("train", trainRecords), ("test", testRecords)):
+            labels = rng.integers(0, 2, size = records)
+
+            for start in range(0, records, chunkImages):
+                if debug: print(split + "Data: images", start, "to", min(start + chunkImages, records) - 1)
+                block = labels[start:start + chunkImages]
+                archive.append(split + "Data", syntheticImages(rng, block, dim, separation))
+
+            archive.writeLabels(split + "Labels", [labels])
+
+    # Check the size on disk
+    print("Archive created.\n")
+    printArchiveSize(outputFile)
+
     return
 
 # Access a given HDF5 image dataset archive file and inspect the contents
@@ -0,0 +1,207 @@
+##################
+##### IMPORTS#####
+##################
+
+import importlib
+import multiprocessing
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os import path
+
+import numpy as np
+import pandas as pd
+
+
+# Benchmark the three generations of the classifier's training engine against each other
+#
+#   utils.py     full batch gradient descent
+#   utils_v1.py  mini batches and dropout
+#   utils_v2.py  mini batches, dropout, and Adam (plus the fused/flat in-place engine)
+#
+# Every case trains on the same seeded synthetic dataset shaped like imageData500_64pixels.hdf5 and runs in its
+# own fresh process, so the peak RSS figure belongs to that case alone.  Results are appended to a CSV file, and
+# each run is compared against the previous one to catch regressions.
+#
+# Usage:  python benchmarks.py [--quick]
+
+####################
+##### SETTINGS #####
+####################
+
+settings = {
+    "trainRecords": 800,
+    "testRecords": 200,
+    "dim": 64,
+    "seed": 10,
+    "iterations": 20,
+    "learningRate": 0.0005,
+    "lamb": 0.5,
+    "dropProb": 0.85,
+    "layerSizes": [[10, 5], [40, 10], [100, 20, 5]],
+    "batchSizes": [32, 128],
+    "resultsFile": "benchmarks.csv",
+    "tolerance": 0.25,
+}
+
+# The engines to benchmark:  (name, module, keyword arguments for that module's model() that override the settings)
+# Adam takes much larger steps than plain gradient descent, so the utils_v2 engines get a smaller learning rate
+engines = [
+    ("utils", "utils", {}),
+    ("utils_v1", "utils_v1", {}),
+    ("utils_v2", "utils_v2", {"learningRate": 0.0001}),
+    ("utils_v2-fused", "utils_v2", {"learningRate": 0.0001, "fused": True, "flat": True}),
+]
+
+
+###########################
+##### SYNTHETIC DATA ######
+###########################
+
+# Create a seeded synthetic dataset with the same layout as loadData() returns:  (12288, m) normalized matrices and
+# (1, m) labels.  Cat images are a little brighter in the red channel, so there is something for the models to learn.
+def syntheticData(trainRecords, testRecords, dim=64, seed=10):
+    rng = np.random.default_rng(seed)
+    data = []
+
+    for m in (trainRecords, testRecords):
+        labels = rng.integers(0, 2, size=(1, m))
+        images = rng.integers(0, 200, size=(m, dim, dim, 3), dtype=np.uint8)
+        images[labels[0] == 1, :, :, 0] += 40
+
+        data.append(images.reshape(m, -1).T / 255.)
+        data.append(labels)
+
+    return data
+
+
+########################
+##### BENCHMARKING #####
+########################
+
+# Peak resident set size of this process in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+def peakRSS():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# Train and score one engine on one configuration; meant to run in a fresh worker process
+def runCase(moduleName, options, hiddenLayerSizes, batchSize):
+    utils = importlib.import_module(moduleName)
+    trainingData, trainingLabels, testData, testLabels = syntheticData(
+        settings["trainRecords"], settings["testRecords"], settings["dim"], settings["seed"]
+    )
+    dims = {
+        "numberInputs": trainingData.shape[0],
+        "numberOutputs": 1,
+        "hiddenLayerSizes": hiddenLayerSizes,
+    }
+
+    # utils.py trains on the full batch and has no dropout
+    args = {"learningRate": settings["learningRate"], "lamb": settings["lamb"]}
+    if moduleName == "utils":
+        batchSize = trainingData.shape[1]
+        args["initializeMultiplier"] = None
+    else:
+        args["batchSize"] = batchSize
+        args["dropProb"] = settings["dropProb"]
+    args.update(options)
+
+    start = time.perf_counter()
+    params, costs, _ = utils.model(
+        data=trainingData,
+        labels=trainingLabels,
+        dims=dims,
+        numIterations=settings["iterations"],
+        **args
+    )
+    seconds = time.perf_counter() - start
+    epochs = settings["iterations"] + 1
+
+    return {
+        "Batch_Size": batchSize,
+        "Sec_Per_Epoch": seconds / epochs,
+        "Samples_Per_Sec": trainingData.shape[1] * epochs / seconds,
+        "Peak_RSS_MB": peakRSS(),
+        "Final_Cost": float(np.squeeze(costs[-1])),
+        "Train_Acc": utils.predict(trainingData, params, trainingLabels)["accuracy"],
+        "Test_Acc": utils.predict(testData, params, testLabels)["accuracy"],
+    }
+
+
+# Run every engine against every layer size/batch size combination; returns the results as a dataframe
+# Each case gets a fresh 'spawn' process so imports, seeds, and the RSS high water mark start from scratch
+def runBenchmarks(layerSizes=None, batchSizes=None):
+    layerSizes = settings["layerSizes"] if layerSizes is None else layerSizes
+    batchSizes = settings["batchSizes"] if batchSizes is None else batchSizes
+    context = multiprocessing.get_context("spawn")
+    stamp = time.strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+
+    for hiddenLayerSizes in layerSizes:
+        for batchSize in batchSizes:
+            for name, moduleName, options in engines:
+                # Full batch training doesn't depend on the batch size, so only run it once per layer size
+                if moduleName == "utils" and batchSize != batchSizes[0]:
+                    continue
+
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(
+                        runCase, moduleName, options, hiddenLayerSizes, batchSize
+                    ).result()
+
+                row = {"Run": stamp, "Engine": name, "Layers": str(hiddenLayerSizes)}
+                row.update(result)
+                rows.append(row)
+                print(
+                    name.ljust(16), row["Layers"].ljust(14), str(row["Batch_Size"]).rjust(5),
+                    "%10.4f s/epoch" % row["Sec_Per_Epoch"],
+                    "%10.0f samples/s" % row["Samples_Per_Sec"],
+                    "%8.1f MB" % row["Peak_RSS_MB"],
+                    "%7.2f%% test" % row["Test_Acc"],
+                )
+
+    return pd.DataFrame(rows)
+
+
+# Compare a run against the most recent earlier run stored in the results file
+# Returns the cases whose time per epoch grew by more than 'tolerance' (e.g. 0.25 for 25%)
+def findRegressions(results, history, tolerance):
+    keys = ["Engine", "Layers", "Batch_Size"]
+    earlier = history[history["Run"] < results["Run"].iloc[0]]
+    if len(earlier) == 0:
+        return pd.DataFrame()
+
+    baseline = earlier[earlier["Run"] == earlier["Run"].max()]
+    merged = results.merge(baseline, on=keys, suffixes=("", "_Baseline"))
+    slower = merged["Sec_Per_Epoch"] > merged["Sec_Per_Epoch_Baseline"] * (1 + tolerance)
+
+    return merged.loc[slower, keys + ["Sec_Per_Epoch_Baseline", "Sec_Per_Epoch"]]
+
+
+# Append a run to the results file and report any regressions against the previous run
+def storeResults(results, resultsFile, tolerance):
+    if path.exists(resultsFile):
+        history = pd.concat([pd.read_csv(resultsFile), results], ignore_index=True)
+    else:
+        history = results
+    history.to_csv(resultsFile, index=False)
+
+    regressions = findRegressions(results, history, tolerance)
+    if len(regressions) != 0:
+        print("\n*** Slower than the previous run:")
+        print(regressions.to_string(index=False))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    if "--quick" in sys.argv:
+        results = runBenchmarks(layerSizes=settings["layerSizes"][:1], batchSizes=settings["batchSizes"][:1])
+    else:
+        results = runBenchmarks()
+
+    resultsFile = path.join(path.dirname(path.abspath(__file__)), settings["resultsFile"])
+    storeResults(results, resultsFile, settings["tolerance"])
+    print("\n*** Results appended to", resultsFile)
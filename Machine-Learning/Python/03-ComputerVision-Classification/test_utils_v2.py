@@ -0,0 +1,111 @@
+##################
+##### IMPORTS#####
+##################
+
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils_v2
+
+
+# Small seeded stand-in for the [trainingData, trainingLabels, testData, testLabels] list from loadData()
+def sweepData(trainRecords=200, testRecords=60, features=32):
+    rng = np.random.default_rng(0)
+    weights = rng.normal(size=(1, features))
+    data = []
+
+    for m in (trainRecords, testRecords):
+        images = rng.random((features, m))
+        data.append(images)
+        data.append(((weights @ (images - 0.5)) > 0).astype(int))
+
+    return data
+
+
+hRanges = {
+    "Learning_Rate": [0.001, 0.01, 0.001],
+    "Iterations": 10,
+    "Lambda": [0, 1, 0.1],
+    "batchSize": 32,
+    "dropProb": [0.8, 1, 0.05],
+    "beta1": 0.9,
+    "beta2": 0.999,
+    "epsilon": 1e-8,
+    "Epoch": None,
+    "networkDimensions": None,
+    "Descending_Graph": None,
+    "Train_Acc": None,
+    "Test_Acc": None,
+    "Final_Cost": None,
+}
+
+
+# Run a seeded sweep of five trials
+def sweep(**options):
+    return utils_v2.runModels(
+        sweepData(), hRanges, 5, (2, 3, 8, 8), silent=True, rngSeed=3, **options
+    )
+
+
+# A sweep that dies after two trials picks up where it left off and gives the same results as an unbroken run,
+# and a finished sweep can be reopened; the results file gets one row per trial however often the sweep is resumed
+@pytest.mark.parametrize("workers", [None, "auto"])
+def testResumeSweep(tmp_path, monkeypatch, workers):
+    expected, expectedParams, expectedCosts = sweep(workers=workers)
+    checkpointDir = str(tmp_path / "sweep")
+    resultsFile = str(tmp_path / "results.csv")
+
+    save = utils_v2.SweepCheckpoint.save
+    saved = []
+
+    def interruptedSave(checkpoint, epoch, result):
+        if len(saved) == 2:
+            raise KeyboardInterrupt
+        saved.append(epoch)
+        save(checkpoint, epoch, result)
+
+    monkeypatch.setattr(utils_v2.SweepCheckpoint, "save", interruptedSave)
+    with pytest.raises(KeyboardInterrupt):
+        sweep(workers=workers, checkpointDir=checkpointDir, resultsFile=resultsFile)
+    monkeypatch.setattr(utils_v2.SweepCheckpoint, "save", save)
+
+    # The second pass reopens a sweep with nothing left to train
+    for _ in range(2):
+        resumed, resumedParams, resumedCosts = sweep(
+            workers=workers, checkpointDir=checkpointDir, resultsFile=resultsFile
+        )
+
+        assert resumed.to_string() == expected.to_string()
+        for epoch in expectedParams:
+            for key in expectedParams[epoch]:
+                assert np.array_equal(resumedParams[epoch][key], expectedParams[epoch][key])
+            assert np.allclose(np.squeeze(resumedCosts[epoch]), np.squeeze(expectedCosts[epoch]))
+
+    assert sorted(pd.read_csv(resultsFile)["Epoch"]) == list(range(5))
+
+
+# Stacking the trials must not change a sweep's results, whatever model() options are passed through
+@pytest.mark.parametrize(
+    "modelOptions", [{"dropoutSeed": 5}, {"evalCost": True}, {"profile": True}, {"prefetch": True}]
+)
+def testStackedSweep(modelOptions):
+    # Timings differ from run to run, so only the columns are compared for those
+    timed = lambda column: column.startswith("Time_") or column in (
+        "Train_Seconds", "Samples_Per_Sec", "Record_Overhead"
+    )
+
+    results = []
+    for stackSize in (None, 4):
+        random.seed(1)
+        resultsDF = utils_v2.runModels(
+            sweepData(), hRanges, 5, (2, 3, 8, 8), silent=True, modelOptions=modelOptions, stackSize=stackSize
+        )[0].sort_index()
+        results.append(resultsDF)
+
+    unstacked, stacked = results
+    assert list(stacked.columns) == list(unstacked.columns)
+    kept = [column for column in unstacked.columns if not timed(column)]
+    assert stacked[kept].equals(unstacked[kept])
@@ -3,6 +3,8 @@
 ##################
 
 import os, h5py
+import csv
+import json
 from matplotlib import pyplot as plt
 import numpy as np
 import random
@@ -15,6 +17,16 @@ import time
 import copy
 import h5py
 import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import queue
+import threading
+
+# threadpoolctl is optional; without it the BLAS thread count of the worker processes is left alone
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
 
 random.seed(10)
 np.random.seed(10)
@@ -73,7 +85,8 @@ def validateArchive(archiveFile, imagesToShow=20):
         # Pull and examine the training data from the HDF5 container
         print("*** IMAGE DATA")
 
-        trainData = np.array(archive["trainData"][:])
+        # Leave the images on disk; only the ones we look at below are read
+        trainData = archive["trainData"]
         print("Image data shape in archive:", trainData.shape)
         print("\n")
 
@@ -104,10 +117,73 @@ def validateArchive(archiveFile, imagesToShow=20):
     return
 
 
-def loadData():
+# Lazy, read-only view of one data/labels pair in an HDF5 image archive (e.g. "trainData" and "trainLabels")
+# Images stay on disk and are flattened and normalized only when a block of records is read, so training can
+# stream epochs with bounded memory.  The labels are small, so they are held in memory.
+class HDF5Dataset:
+
+    def __init__(self, fileName, dataKey="trainData", labelsKey="trainLabels", dtype=np.float64):
+        self.fileName = fileName
+        self.archive = h5py.File(fileName, "r")
+        self.data = self.archive[dataKey]
+        self.labels = np.asarray(self.archive[labelsKey][:], dtype=dtype)
+        self.dtype = np.dtype(dtype)
+
+        # One column per image and one row per pixel color value, like the matrices built by loadData()
+        self.m = self.data.shape[0]
+        self.features = int(np.prod(self.data.shape[1:]))
+        self.shape = (self.features, self.m)
+
+        # Read in blocks that line up with the archive chunks when there are any
+        if self.data.chunks is not None:
+            self.blockSize = self.data.chunks[0]
+        else:
+            self.blockSize = 1024
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # Close the HDF5 container
+    def close(self):
+        self.archive.close()
+
+    # Read records [start, stop) from disk into 'raw' (a reusable buffer in the archive's own dtype)
+    def readRaw(self, start, stop, raw):
+        n = stop - start
+        self.data.read_direct(raw[:n], np.s_[start:stop], np.s_[0:n])
+        return raw[:n].reshape(n, -1)
+
+    # Read records [start, stop) as a flattened, normalized (features, n) matrix
+    def read(self, start=0, stop=None):
+        stop = self.m if stop is None else min(stop, self.m)
+        raw = np.empty((stop - start,) + self.data.shape[1:], dtype=self.data.dtype)
+        raw = self.readRaw(start, stop, raw)
+
+        return np.divide(raw.T, 255., dtype=self.dtype)
+
+    # Return a mini batch loader that streams shuffled batches from disk
+    def loader(self, batchSize, prefetch=False):
+        return HDF5BatchLoader(self, batchSize, prefetch)
+
+
+# 'dtype' sets the floating point precision of the normalized data (e.g. np.float32 to halve the memory footprint)
+# Set 'lazy' to get HDF5Dataset objects that stream from disk in place of the in-memory data matrices
+def loadData(dtype=np.float64, lazy=False):
     # Examine the data used for training the model
     imageData = path.join("datasets", "imageData500_64pixels.hdf5")
 
+    if lazy:
+        trainingData = HDF5Dataset(imageData, "trainData", "trainLabels", dtype)
+        testData = HDF5Dataset(imageData, "testData", "testLabels", dtype)
+
+        print("Lazy trainingData shape:  " + str(trainingData.shape))
+        print("Lazy testData shape:      " + str(testData.shape))
+
+        return trainingData, trainingData.labels, testData, testData.labels
+
     # Load, shape, and normalize the data used for training the model
     with h5py.File(imageData, "r") as archive:
         trainingData = np.squeeze(archive["trainData"][:])
@@ -130,8 +206,8 @@ def loadData():
     print("Flattened, normalized testData shape:      " + str(testData.shape))
 
     # Normalization
-    trainingData = trainingData / 255.
-    testData = testData / 255.
+    trainingData = np.divide(trainingData, 255., dtype=dtype)
+    testData = np.divide(testData, 255., dtype=dtype)
 
     validateArchive(imageData)
 
@@ -166,24 +242,123 @@ def printCostGraphs(costs, keys, cols, fsize=(15, 6)):
 # Randomize values for hyperparameters based on a given key:value dictionary
 class HPicker:
 
+    # 'sampler' sets how the values are picked from each range's grid:
+    #   "random"  uniformly at random (the original behavior; uses Python's 'random' module)
+    #   "sobol"   scrambled Sobol sequence, which spreads the picks evenly over the space
+    #   "lhs"     Latin hypercube; every 'budget' picks cover each range's grid in even strata
+    #   "tpe"     Tree-structured Parzen Estimator; after 'startupTrials' observed results (see observe()) each range
+    #             is picked where the best 'gamma' share of the trials so far are dense and the rest are sparse
+    # The "sobol" and "lhs" samplers need scipy
+    # Pass a Generator as 'rng' to have the "random" sampler draw from it in place of the 'random' module
+    def __init__(
+        self, sampler="random", seed=10, budget=32, startupTrials=10, gamma=0.25, candidates=24, rng=None
+    ):
+        if sampler not in ("random", "sobol", "lhs", "tpe"):
+            raise ValueError("sampler must be 'random', 'sobol', 'lhs', or 'tpe'")
+
+        self.sampler = sampler
+        self.seed = seed
+        self.budget = budget
+        self.startupTrials = startupTrials
+        self.gamma = gamma
+        self.candidates = candidates
+        self.rng = np.random.default_rng(seed)
+        self.randomRng = rng
+        self.grids = {}
+        self.engine = None
+        self.points = []
+        self.observed = []
+
+    # Return the grid of possible values for a [start, stop, step] range; grids are built once and cached
+    def grid(self, value):
+        key = tuple(value)
+        if key not in self.grids:
+            start, stop, step = value
+            vals = []
+
+            # Create a range of possible values
+            while start < stop:
+                start = round(start + step, len(str(step)))
+                vals.append(start)
+
+            self.grids[key] = vals
+
+        return self.grids[key]
+
+    # Draw the next point of the unit hypercube from the Sobol or Latin hypercube sequence
+    def nextPoint(self, dims):
+        if not self.points:
+            from scipy.stats import qmc
+
+            if self.engine is None:
+                if self.sampler == "sobol":
+                    self.engine = qmc.Sobol(d=dims, scramble=True, seed=self.seed)
+                else:
+                    self.engine = qmc.LatinHypercube(d=dims, seed=self.seed)
+
+            # Sobol points are best drawn in powers of two
+            count = self.budget
+            if self.sampler == "sobol":
+                count = 2 ** int(math.ceil(math.log2(max(count, 1))))
+            self.points = list(self.engine.random(count))
+
+        return self.points.pop(0)
+
+    # Record a trial's results for the "tpe" sampler; 'score' is maximized (e.g. "Test_Acc")
+    def observe(self, hparams, score):
+        if score is not None and np.isfinite(score):
+            self.observed.append((hparams, score))
+
+    # Parzen estimate over a grid's indexes:  a Gaussian kernel on every observed index plus a flat prior
+    def parzen(self, indexes, size):
+        positions = np.arange(size)
+        bandwidth = max(1.0, size / 10)
+        density = np.full(size, 1.0 / size)
+
+        for index in indexes:
+            kernel = np.exp(-0.5 * ((positions - index) / bandwidth) ** 2)
+            density += kernel / kernel.sum()
+
+        return density / density.sum()
+
+    # Pick a grid index with the TPE rule:  the candidate drawn from the good density with the best good/bad ratio
+    def pickTPE(self, key, vals):
+        ranked = sorted(self.observed, key=lambda observed: observed[1], reverse=True)
+        split = max(1, int(math.ceil(self.gamma * len(ranked))))
+        closest = lambda hparams: int(np.argmin(np.abs(np.asarray(vals) - hparams[key])))
+
+        good = self.parzen([closest(hparams) for hparams, _ in ranked[:split]], len(vals))
+        bad = self.parzen([closest(hparams) for hparams, _ in ranked[split:]], len(vals))
+
+        candidates = self.rng.choice(len(vals), size=self.candidates, p=good)
+        return candidates[np.argmax(good[candidates] / bad[candidates])]
+
     def pick(self, ranges):
         hParams = {}
+        grids = {key: self.grid(value) for key, value in ranges.items() if isinstance(value, list)}
+
+        if self.sampler in ("sobol", "lhs") and grids:
+            point = dict(zip(grids, self.nextPoint(len(grids))))
 
         # For each parameter key:val
         for key, value in ranges.items():
-            if isinstance(value, list):
-                start, stop, step = value
-                vals = []
-
-                # Create a range of possible values
-                while start < stop:
-                    start = round(start + step, len(str(step)))
-                    vals.append(start)
-
+            if key not in grids:
+                hParams[key] = value
+                continue
+            vals = grids[key]
+
+            if self.sampler in ("sobol", "lhs"):
+                # Map the point's coordinate for this range onto its grid
+                hParams[key] = vals[min(int(point[key] * len(vals)), len(vals) - 1)]
+            elif self.sampler == "tpe" and len(self.observed) >= self.startupTrials:
+                hParams[key] = vals[self.pickTPE(key, vals)]
+            elif self.sampler == "tpe":
+                hParams[key] = vals[self.rng.integers(len(vals))]
+            elif self.randomRng is not None:
+                hParams[key] = vals[self.randomRng.integers(len(vals))]
+            else:
                 # Pick one of the possible values randomly
                 hParams[key] = random.choice(vals)
-            else:
-                hParams[key] = value
 
         return hParams
 
@@ -196,92 +371,839 @@ def getResultsDF(hRanges):
     return df
 
 
-# Do all the heavy lifting required when running N number of models with various hyperparameter configurations
-def runModels(data, hRanges, epochs, layerSizes, silent=False):
+# Pick the hyperparams and the network dimensions for a single trial
+# Pass a Generator as 'rng' to draw the network dimensions from it in place of the 'random' module
+def pickTrial(picker, hRanges, epoch, layerSizes, trainingData, trainingLabels, rng=None):
+    # Get the random hyperparam values
+    hparams = picker.pick(hRanges)
+    hparams["Epoch"] = epoch
 
-    # Var inits
-    picker = HPicker()
-    resultsDF = getResultsDF(hRanges)
-    costs = {}
-    params = {}
-    epoch = 0
+    # Randomize the number of layers in the network and the number of cells in each layer
+    dims = list()
+    if rng is not None:
+        dims.append(int(rng.integers(layerSizes[0], layerSizes[1])))
+    else:
+        dims.append(random.randrange(layerSizes[0], layerSizes[1], 1))
+    dims.append(layerSizes[2])
+    dims.append(layerSizes[3])
+    hparams["networkDimensions"] = defineDimensions(
+        trainingData, trainingLabels, dims, rng
+    )
+
+    return hparams
+
+
+# Print a summary of the model about to be trained and its params to the user
+def printTrialSummary(hparams):
+    print(
+        "Training model", hparams["Epoch"],
+        "with params:  LR", hparams["Learning_Rate"],
+        ", iterations", hparams["Iterations"],
+        ", NN dims", (hparams["networkDimensions"])["hiddenLayerSizes"],
+        ", lambda", hparams["Lambda"],
+        ", batchSize", hparams["batchSize"],
+        ", dropProb", hparams["dropProb"],
+        ", beta1", hparams["beta1"],
+        ", beta2", hparams["beta2"],
+        ", epsilon", hparams["epsilon"],
+    )
+
+
+# Train and evaluate a single trial; returns the trained params, the cost curve, and the completed hparams
+# 'modelOptions' holds any extra keyword arguments for model() (e.g. {"fused": True})
+def trainTrial(data, hparams, modelOptions=None):
     trainingData, trainingLabels, testData, testLabels = data
+    modelOptions = dict(modelOptions or {})
+
+    # Every trial draws from its own random streams when a root seed is given
+    if modelOptions.get("rngSeed") is not None:
+        modelOptions["trial"] = hparams["Epoch"]
+
+    # Have model() report why it stopped when early stopping is turned on, and its timings when profiling is
+    report = {}
+    if modelOptions.get("earlyStop") is not None or modelOptions.get("profile"):
+        modelOptions["report"] = report
+
+    # Train the model its given hyperparams and record the results
+    trialParams, trialCosts, hparams["Descending_Graph"] = model(
+        data=trainingData,
+        labels=trainingLabels,
+        dims=hparams["networkDimensions"],
+        numIterations=hparams["Iterations"],
+        learningRate=hparams["Learning_Rate"],
+        lamb=hparams["Lambda"],
+        batchSize=hparams["batchSize"],
+        dropProb=hparams["dropProb"],
+        beta1=hparams["beta1"],
+        beta2=hparams["beta2"],
+        epsilon=hparams["epsilon"],
+        printCost=False,
+        showGraph=False,
+        **modelOptions,
+    )
 
-    print("\n*** Starting model training")
+    hparams.update(report)
 
-    while epoch < epochs:
+    return scoreTrial(data, hparams, trialParams, trialCosts)
 
-        # Get the random hyperparam values
-        hparams = picker.pick(hRanges)
-        hparams["Epoch"] = epoch
 
-        # Randomize the number of layers in the network and the number of cells in each layer
-        dims = list()
-        dims.append(random.randrange(layerSizes[0], layerSizes[1], 1))
-        dims.append(layerSizes[2])
-        dims.append(layerSizes[3])
-        hparams["networkDimensions"] = defineDimensions(
-            trainingData, trainingLabels, dims
+# Make predictions with a trained trial and record the results in its hparams
+def scoreTrial(data, hparams, trialParams, trialCosts):
+    trainingData, trainingLabels, testData, testLabels = data
+
+    # Make predictions based on the model
+    trainingPreds = predict(trainingData, trialParams, trainingLabels)
+    testPreds = predict(testData, trialParams, testLabels)
+
+    # Record prediction results
+    hparams["Train_Acc"] = trainingPreds["accuracy"]
+    hparams["Test_Acc"] = testPreds["accuracy"]
+    hparams["Final_Cost"] = trialCosts[-1]
+    hparams["networkDimensions"] = str(
+        (hparams["networkDimensions"])["hiddenLayerSizes"]
+    )
+
+    return trialParams, trialCosts, hparams
+
+
+# Train and evaluate a group of trials that share a network shape, batch size, and iteration count as one
+# ModelStack; only the "dtype" and "prefetch" entries of 'modelOptions' apply to stacked training (see canStack())
+def trainTrialStack(data, group, modelOptions=None):
+    trainingData, trainingLabels, testData, testLabels = data
+    modelOptions = modelOptions or {}
+    first = group[0]
+
+    # Train every model in the group at once
+    results = modelStack(
+        data=trainingData,
+        labels=trainingLabels,
+        dims=first["networkDimensions"],
+        numIterations=first["Iterations"],
+        learningRates=[hparams["Learning_Rate"] for hparams in group],
+        lambdas=[hparams["Lambda"] for hparams in group],
+        batchSize=first["batchSize"],
+        dropProbs=[hparams["dropProb"] for hparams in group],
+        beta1s=[hparams["beta1"] for hparams in group],
+        beta2s=[hparams["beta2"] for hparams in group],
+        epsilons=[hparams["epsilon"] for hparams in group],
+        printCost=False,
+        prefetch=modelOptions.get("prefetch", False),
+        dtype=modelOptions.get("dtype", np.float64),
+    )
+
+    # Score each model on its own
+    scored = []
+    for hparams, (trialParams, trialCosts, descendingGraph) in zip(group, results):
+        hparams["Descending_Graph"] = descendingGraph
+        scored.append(scoreTrial(data, hparams, trialParams, trialCosts))
+
+    return scored
+
+
+# True if a ModelStack trains the same models model() would with these 'modelOptions':  every entry other than
+# "dtype" and "prefetch" has to be left at model()'s default.  The stack shares one set of shuffled batches and
+# dropout masks between its models, records its cost like model() does by default, and doesn't stop early or
+# profile, so any other option (e.g. "rngSeed", "dropoutSeed", "evalCost", "earlyStop", or "profile") means the
+# models are trained one at a time.
+def canStack(modelOptions):
+    defaults = inspect.signature(model).parameters
+    for key, value in (modelOptions or {}).items():
+        if key in ("dtype", "prefetch"):
+            continue
+        if key not in defaults or value != defaults[key].default:
+            return False
+
+    return True
+
+
+# Split trials into groups that can be trained together as a ModelStack, at most 'stackSize' trials per group
+# Trials can share a stack when they have the same hidden layer sizes, batch size, and iteration count
+# Returns the groups along with the trial indexes in each, so results can be put back in trial order
+def groupTrials(trials, stackSize):
+    groups = {}
+    for index, hparams in enumerate(trials):
+        key = (
+            tuple(hparams["networkDimensions"]["hiddenLayerSizes"]),
+            hparams["batchSize"],
+            hparams["Iterations"],
         )
+        groups.setdefault(key, []).append(index)
+
+    indexes = []
+    for members in groups.values():
+        for start in range(0, len(members), stackSize):
+            indexes.append(members[start : start + stackSize])
+
+    return [[trials[index] for index in members] for members in indexes], indexes
+
+
+# Columnar store for trial results
+# Each column is a preallocated, typed Numpy array (bool, int64, float64, or object, picked from the first value and
+# widened if a later value needs it) that grows by doubling, and the dataframe is only built once at the end.
+# Values are matched to columns by name; any extra result fields (e.g. "Stop_Reason") become new columns.
+# Set 'streamFile' to also append each row to a CSV file as it arrives, so results can be read while a sweep runs;
+# the file's columns are fixed by the first row written to it.
+class ResultsStore:
+
+    def __init__(self, columns, capacity=16, streamFile=None):
+        self.capacity = max(1, capacity)
+        self.count = 0
+        self.index = np.empty(self.capacity, dtype=np.int64)
+        self.columns = {}
+        self.filled = {}
+        for column in columns:
+            self.addColumn(column, object)
+
+        self.streamFile = streamFile
+        self.stream = None
+        self.writer = None
+        self.streamColumns = None
+
+    # Numpy type used to store a value
+    @staticmethod
+    def typeOf(value):
+        if isinstance(value, (bool, np.bool_)):
+            return np.bool_
+        if isinstance(value, (int, np.integer)):
+            return np.int64
+        if isinstance(value, (float, np.floating)):
+            return np.float64
+        return object
+
+    # Add an empty column; it takes the type of the first value stored in it
+    def addColumn(self, column, kind):
+        self.columns[column] = np.empty(self.capacity, dtype=kind)
+        self.filled[column] = np.zeros(self.capacity, dtype=np.bool_)
+
+    # Make sure a column can hold a value, widening its type if it can't (int to float, anything else to object)
+    def fitColumn(self, column, value):
+        array = self.columns[column]
+        kind = self.typeOf(value)
+
+        if not self.filled[column][: self.count].any():
+            if array.dtype != kind:
+                self.columns[column] = np.empty(self.capacity, dtype=kind)
+        elif array.dtype != kind and array.dtype != object:
+            if {array.dtype.type, kind} == {np.int64, np.float64}:
+                self.columns[column] = array.astype(np.float64)
+            else:
+                self.columns[column] = array.astype(object)
+
+    # Double the capacity of every column
+    def grow(self):
+        self.capacity = self.capacity * 2
+        self.index = np.resize(self.index, self.capacity)
+        for column in self.columns:
+            self.columns[column] = np.resize(self.columns[column], self.capacity)
+            filled = np.zeros(self.capacity, dtype=np.bool_)
+            filled[: self.count] = self.filled[column][: self.count]
+            self.filled[column] = filled
+
+    # Add a trial's results as the row labeled 'epoch'; set 'stream' to False to keep the row out of the stream file
+    def append(self, epoch, hparams, stream=True):
+        if self.count == self.capacity:
+            self.grow()
+
+        row = self.count
+        self.index[row] = epoch
+        for column, value in hparams.items():
+            if column not in self.columns:
+                self.addColumn(column, self.typeOf(value))
+            if value is not None:
+                self.fitColumn(column, value)
+                self.columns[column][row] = value
+                self.filled[column][row] = True
+        self.count = row + 1
+
+        if self.streamFile is not None and stream:
+            self.writeRow(hparams)
+
+    # Append a row to the stream file, writing the header first if the file is new
+    def writeRow(self, hparams):
+        if self.stream is None:
+            newFile = not path.exists(self.streamFile) or path.getsize(self.streamFile) == 0
+            self.stream = open(self.streamFile, "a", newline="")
+            self.writer = csv.writer(self.stream)
+            self.streamColumns = list(self.columns)
+            if newFile:
+                self.writer.writerow(self.streamColumns)
+
+        values = [hparams.get(column) for column in self.streamColumns]
+        self.writer.writerow(["" if value is None else value for value in values])
+        self.stream.flush()
+
+    # Close the stream file
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    # Build the results dataframe; rows without a value for a column get None (NaN in float columns)
+    def toDataFrame(self):
+        data = {}
+        for column, array in self.columns.items():
+            values = array[: self.count]
+            filled = self.filled[column][: self.count]
+            if not filled.all():
+                values = values.astype(np.float64 if values.dtype == np.float64 else object)
+                values[~filled] = np.nan if values.dtype == np.float64 else None
+            data[column] = values
+
+        return pd.DataFrame(data, index=self.index[: self.count].copy())
+
+
+# Copy a list of arrays into shared memory blocks so worker processes can read them without pickling
+def shareArrays(arrays):
+    blocks = []
+    specs = []
+
+    for array in arrays:
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared[...] = array
+        blocks.append(block)
+        specs.append((block.name, array.shape, array.dtype.str))
+
+    return blocks, specs
+
+
+# Release the shared memory blocks created by shareArrays()
+def releaseArrays(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+# Worker process state:  the attached shared memory blocks, the array views built on top of them, and the BLAS limit
+workerState = {"blocks": [], "data": None, "limits": None}
+
+
+# Limit the number of BLAS threads used by this process; returns the threadpoolctl limiter (None if not limited)
+def limitBlasThreads(threads):
+    if threads is None or threadpool_limits is None:
+        return None
+    return threadpool_limits(limits=threads, user_api="blas")
+
+
+# Process pool initializer; attach to the shared training/test matrices once per worker
+# 'blasThreads' caps the BLAS thread pool of each worker, so the workers don't oversubscribe the cores
+def attachSharedArrays(specs, blasThreads=None):
+    workerState["limits"] = limitBlasThreads(blasThreads)
+    blocks = []
+    data = []
+
+    for name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=name)
+        blocks.append(block)
+        data.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf))
+
+    workerState["blocks"] = blocks
+    workerState["data"] = data
+
+
+# Process pool task; train a trial against the shared matrices attached by attachSharedArrays()
+def trainSharedTrial(hparams, modelOptions=None):
+    return trainTrial(workerState["data"], hparams, modelOptions)
+
+
+# Process pool task; train a group of trials as a ModelStack against the shared matrices
+def trainSharedTrialStack(group, modelOptions=None):
+    return trainTrialStack(workerState["data"], group, modelOptions)
 
-        # Print a summary of the model about to be trained and its params to the user
-        if silent is not True:
-            print(
-                "Training model", epoch,
-                "with params:  LR", hparams["Learning_Rate"],
-                ", iterations", hparams["Iterations"],
-                ", NN dims", (hparams["networkDimensions"])["hiddenLayerSizes"],
-                ", lambda", hparams["Lambda"],
-                ", batchSize", hparams["batchSize"],
-                ", dropProb", hparams["dropProb"],
-                ", beta1", hparams["beta1"],
-                ", beta2", hparams["beta2"],
-                ", epsilon", hparams["epsilon"],
-            )
 
-        # Train the model its given hyperparams and record the results
-        params[epoch], costs[epoch], hparams["Descending_Graph"] = model(
-            data=trainingData,
-            labels=trainingLabels,
-            dims=hparams["networkDimensions"],
-            numIterations=hparams["Iterations"],
-            learningRate=hparams["Learning_Rate"],
-            lamb=hparams["Lambda"],
-            batchSize=hparams["batchSize"],
-            dropProb=hparams["dropProb"],
-            beta1=hparams["beta1"],
-            beta2=hparams["beta2"],
-            epsilon=hparams["epsilon"],
-            printCost=False,
-            showGraph=False,
+# Run 'task' over the given trials (or trial groups) in a pool of worker processes
+# Results come back in the same order as the trials; 'onResult(index, result)' is called as each one finishes, so
+# the calls come in the order the trials finish rather than in trial order
+def trainTrialsParallel(
+    data, trials, workers, modelOptions=None, task=trainSharedTrial, onResult=None, blasThreads=None
+):
+    blocks, specs = shareArrays(data)
+    results = [None] * len(trials)
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=attachSharedArrays, initargs=(specs, blasThreads)
+        ) as executor:
+            futures = {
+                executor.submit(task, trial, modelOptions): index
+                for index, trial in enumerate(trials)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                results[index] = future.result()
+                if onResult is not None:
+                    onResult(index, results[index])
+    finally:
+        releaseArrays(blocks)
+
+    return results
+
+
+# Train a list of trials serially, or in a pool of worker processes when 'workers' is greater than one
+# Set 'stackSize' to train up to that many same-shape trials at once as a ModelStack
+# Results come back in the same order as the trials either way; 'onResult(index, result)' is called with each
+# trial's index as soon as that trial (or its stack) finishes
+# 'blasThreads' caps the BLAS threads of each worker process (or of this process when training serially)
+def trainTrials(
+    data,
+    trials,
+    workers=None,
+    modelOptions=None,
+    silent=False,
+    stackSize=None,
+    onResult=None,
+    blasThreads=None,
+):
+    # Only stack the trials when the stack trains the same models model() would (see canStack())
+    stacked = stackSize is not None and stackSize > 1 and canStack(modelOptions)
+    serial = workers is None or workers <= 1
+
+    if serial:
+        limiter = limitBlasThreads(blasThreads)
+
+    try:
+        if serial and not stacked:
+            results = []
+            for hparams in trials:
+                if silent is not True:
+                    printTrialSummary(hparams)
+                results.append(trainTrial(data, hparams, modelOptions))
+                if onResult is not None:
+                    onResult(len(results) - 1, results[-1])
+            return results
+
+        return trainTrialGroups(
+            data, trials, workers, modelOptions, silent, stackSize, onResult, blasThreads, stacked
         )
+    finally:
+        if serial and limiter is not None:
+            limiter.restore_original_limits()
+
+
+# Train trials in worker processes and/or as ModelStacks; see trainTrials()
+def trainTrialGroups(
+    data, trials, workers, modelOptions, silent, stackSize, onResult, blasThreads, stacked
+):
+
+    if silent is not True:
+        for hparams in trials:
+            printTrialSummary(hparams)
+
+    if stacked:
+        groups, indexes = groupTrials(trials, stackSize)
+        results = [None] * len(trials)
+
+        # Put the results back in trial order as each group finishes
+        def onGroup(group, scored):
+            for index, result in zip(indexes[group], scored):
+                results[index] = result
+                if onResult is not None:
+                    onResult(index, result)
 
-        # Make predictions based on the model
-        trainingPreds = predict(trainingData, params[epoch], trainingLabels)
-        testPreds = predict(testData, params[epoch], testLabels)
+        if workers is None or workers <= 1:
+            for group, members in enumerate(groups):
+                onGroup(group, trainTrialStack(data, members, modelOptions))
+        else:
+            trainTrialsParallel(
+                data,
+                groups,
+                workers,
+                modelOptions,
+                task=trainSharedTrialStack,
+                onResult=onGroup,
+                blasThreads=blasThreads,
+            )
+
+    else:
+        results = trainTrialsParallel(
+            data, trials, workers, modelOptions, onResult=onResult, blasThreads=blasThreads
+        )
 
-        # Record prediction results
-        hparams["Train_Acc"] = trainingPreds["accuracy"]
-        hparams["Test_Acc"] = testPreds["accuracy"]
-        hparams["Final_Cost"] = costs[epoch][-1]
-        hparams["networkDimensions"] = str(
-            (hparams["networkDimensions"])["hiddenLayerSizes"]
+    return results
+
+
+# Number of cores this process is allowed to run on
+def availableCores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Multiply-adds in one training step of a trial:  the batch size times the size of every weight matrix
+def stepWork(hparams):
+    dims = hparams["networkDimensions"]
+    sizes = [dims["numberInputs"]] + list(dims["hiddenLayerSizes"]) + [dims["numberOutputs"]]
+    return hparams["batchSize"] * sum(n * nPrev for n, nPrev in zip(sizes[1:], sizes[:-1]))
+
+
+# Ways to split the cores between worker processes and BLAS threads:  (workers, blasThreads) pairs
+def coreSplits(cores):
+    splits = []
+    threads = 1
+    while threads <= cores:
+        splits.append((cores // threads, threads))
+        threads = threads * 2
+    return splits
+
+
+# Choose how to split the cores between worker processes and BLAS threads for a set of trials
+# Separate trials scale almost perfectly across processes, so there is one worker per core (never more workers than
+# trials).  Cores left over when there are fewer trials than cores go to the BLAS threads, but only as many threads
+# as the matrix multiplies can keep busy:  each thread gets at least 'workPerThread' multiply-adds per training step
+# of the median trial (see stepWork()).  Returns (workers, blasThreads).
+def planWorkers(trials, cores=None, workPerThread=2e7):
+    cores = availableCores() if cores is None else cores
+    work = np.median([stepWork(hparams) for hparams in trials])
+    workers = max(1, min(cores, len(trials)))
+
+    threads = 1
+    while threads * 2 <= cores // workers and work / (threads * 2) >= workPerThread:
+        threads = threads * 2
+
+    return workers, threads
+
+
+# Auto-tuning probe:  time every core split (see coreSplits()) on the current machine and return the fastest
+# Each split trains one copy of a representative trial (the median by stepWork(), cut down to 'probeIterations')
+# per worker.  The training time is measured inside the workers (model()'s profile timings), so process start up
+# isn't counted; the split with the most trials per second wins.  Returns (workers, blasThreads).
+def tuneWorkers(data, trials, cores=None, probeIterations=2, modelOptions=None):
+    cores = availableCores() if cores is None else cores
+    work = [stepWork(hparams) for hparams in trials]
+    sample = copy.deepcopy(trials[int(np.argsort(work)[len(work) // 2])])
+    sample["Iterations"] = probeIterations
+    probeOptions = dict(modelOptions or {}, profile=True)
+    probeOptions.pop("earlyStop", None)
+
+    best = None
+    for workers, threads in coreSplits(cores):
+        probe = [copy.deepcopy(sample) for _ in range(workers)]
+        results = trainTrials(
+            data, probe, workers, probeOptions, silent=True, blasThreads=threads
         )
+        seconds = max(hparams["Train_Seconds"] for _, _, hparams in results)
+        rate = workers / seconds
 
-        # Add model results to the pandas dataframe
-        resultsDF.loc[epoch] = list(hparams.values())
-        epoch = epoch + 1
+        if best is None or rate > best[0]:
+            best = (rate, workers, threads)
+
+    return best[1], best[2]
+
+
+# Resolve runModels()' 'workers' setting:  a number, "auto" (planWorkers()), or "tune" (tuneWorkers())
+# Returns (workers, blasThreads); an explicit 'blasThreads' is kept as is
+def scheduleWorkers(data, trials, workers, blasThreads, modelOptions):
+    if workers == "auto":
+        workers, plannedThreads = planWorkers(trials)
+    elif workers == "tune":
+        workers, plannedThreads = tuneWorkers(data, trials, modelOptions=modelOptions)
+    else:
+        return workers, blasThreads
+
+    return workers, plannedThreads if blasThreads is None else blasThreads
+
+
+# Cast the [trainingData, trainingLabels, testData, testLabels] list for a sweep to 'dtype'
+# HDF5Dataset inputs (see loadData(lazy=True)) stream from disk in their own dtype, so they are left as they are;
+# returns the data and whether any of it is lazy
+def castSweepData(data, dtype):
+    lazy = any(isinstance(array, HDF5Dataset) for array in data)
+    data = [
+        array if isinstance(array, HDF5Dataset) else np.asarray(array, dtype=dtype)
+        for array in data
+    ]
+
+    return data, lazy
+
+
+# Do all the heavy lifting required when running N number of models with various hyperparameter configurations
+# Set 'workers' to a number greater than one to train the models in parallel worker processes
+# Lazy data from loadData(lazy=True) streams from disk; those sweeps always train one trial at a time
+# 'modelOptions' holds any extra keyword arguments passed through to model() (e.g. {"fused": True})
+# 'dtype' sets the floating point precision used for the data and every model trained (e.g. np.float32)
+# Set 'stackSize' to train up to that many trials with the same network shape, batch size, and iteration count at
+# once as a ModelStack (one set of batched matrix multiplies per step rather than one per model); stacking is
+# turned off when 'rngSeed' is set
+# Set 'resultsFile' to append each trial's results to that CSV file as soon as the trial finishes
+# 'sampler' picks the HPicker sampler ("random", "sobol", "lhs", or "tpe"); with "tpe" the trials are picked and
+# trained in rounds (one trial, or one per worker) so every round learns from the "Test_Acc" of the ones before it
+# 'rngSeed' derives every random draw (the picks, and each trial's weights, shuffles, and dropout masks) from
+# RandomStreams(rngSeed), so the results are the same whether the trials are trained serially or in parallel
+# 'workers' can also be "auto" or "tune" to split the cores between worker processes and BLAS threads (see
+# planWorkers() and tuneWorkers()); 'blasThreads' caps the BLAS threads per worker directly
+# Set 'checkpointDir' to save every finished trial to that sweep directory (see SweepCheckpoint); rerunning with the
+# same directory resumes the sweep, loading the trials that already finished instead of training them again
+def runModels(
+    data,
+    hRanges,
+    epochs,
+    layerSizes,
+    silent=False,
+    workers=None,
+    modelOptions=None,
+    dtype=np.float64,
+    stackSize=None,
+    resultsFile=None,
+    sampler="random",
+    rngSeed=None,
+    blasThreads=None,
+    checkpointDir=None,
+):
+
+    # Var inits
+    checkpoint = SweepCheckpoint(checkpointDir) if checkpointDir is not None else None
+    streams = RandomStreams(rngSeed) if rngSeed is not None else None
+    picker = HPicker(
+        sampler,
+        seed=int(streams.generator("picker", 1).integers(2**32)) if streams else 10,
+        budget=epochs,
+        rng=streams.generator("picker") if streams else None,
+    )
+    layersRng = streams.generator("layers") if streams else None
+    store = ResultsStore(hRanges.keys(), epochs, resultsFile)
+    costs = {}
+    params = {}
+
+    # Cast the data once up front rather than once per trial
+    # Lazy HDF5Dataset inputs can't be shared with worker processes or stacked, so those are trained serially
+    data, lazy = castSweepData(data, dtype)
+    if lazy:
+        workers, stackSize = None, None
+    modelOptions = dict(modelOptions or {}, dtype=dtype, rngSeed=rngSeed)
+    trainingData, trainingLabels, testData, testLabels = data
+
+    print("\n*** Starting model training")
+
+    # Pick every trial's hyperparams up front, so serial and parallel runs train the same configurations
+    # The model-based sampler has to see results before it can pick, so it works through the trials in rounds of one
+    # trial per worker; "auto" and "tune" are only resolved once the first round is picked, so that round has one
+    # trial per core
+    roundSize = epochs
+    if sampler == "tpe" and isinstance(workers, str):
+        roundSize = min(availableCores(), epochs)
+    elif sampler == "tpe":
+        roundSize = max(1, workers or 1)
+
+    try:
+        first = 0
+        while first < epochs:
+            trials = [
+                pickTrial(
+                    picker, hRanges, epoch, layerSizes, trainingData, trainingLabels, layersRng
+                )
+                for epoch in range(first, min(first + roundSize, epochs))
+            ]
+
+            # A resumed sweep keeps the picks it saved the first time around (the new picks are still made above, so
+            # the random state moves along the same way)
+            if checkpoint is not None:
+                trials = checkpoint.plan(trials)
+
+            # Add model results to the results store as each trial finishes
+            finished = {}
+
+            def onResult(epoch, result, stream=True):
+                params[epoch], costs[epoch], finished[epoch] = result
+                store.append(epoch, finished[epoch], stream)
+
+            # Trials that finished before the sweep was interrupted are loaded rather than trained; their rows were
+            # streamed to 'resultsFile' the first time around, so they aren't written to it again
+            pending = []
+            for hparams in trials:
+                if checkpoint is not None and checkpoint.isFinished(hparams["Epoch"]):
+                    onResult(hparams["Epoch"], checkpoint.load(hparams["Epoch"]), stream=False)
+                else:
+                    pending.append(hparams)
+
+            def onPending(index, result, pending=pending):
+                if checkpoint is not None:
+                    checkpoint.save(pending[index]["Epoch"], result)
+                onResult(pending[index]["Epoch"], result)
+
+            # Split the cores once the first trials are known, whether or not any of them still need training
+            if isinstance(workers, str):
+                workers, blasThreads = scheduleWorkers(
+                    data, trials, workers, blasThreads, modelOptions
+                )
+
+            if pending:
+                trainTrials(
+                    data, pending, workers, modelOptions, silent, stackSize, onPending, blasThreads
+                )
+
+            # Feed the round's results back to the picker in trial order, however the trials finished
+            for hparams in trials:
+                picker.observe(finished[hparams["Epoch"]], finished[hparams["Epoch"]]["Test_Acc"])
+
+            first = first + len(trials)
+            if sampler == "tpe":
+                roundSize = max(1, workers or 1)
+    finally:
+        store.close()
 
     print("*** Done!\n")
 
     # Sort the dataframe so it's easier to find the results we are interested in
-    resultsDF = resultsDF.sort_values(
+    # Trials arrive in the order they finish, so put them back in trial order first to break ties the same way
+    resultsDF = store.toDataFrame().sort_index().sort_values(
         by=["Descending_Graph", "Test_Acc"], ascending=False
     )
 
     return resultsDF, params, costs
 
 
+# Successive halving version of runModels()
+# Every configuration is first trained on a small fraction of its "Iterations"; only the best 1/eta of them (ranked
+# by 'metric') are promoted to the next, eta times larger budget, until the survivors train for the full count.
+# model() is fully seeded, so a promoted trial is simply retrained with the larger budget; this gives the same
+# result as continuing the earlier run.  The results gain a "Budget" column with the iterations each trial reached.
+def runModelsHalving(
+    data,
+    hRanges,
+    epochs,
+    layerSizes,
+    eta=3,
+    rungs=None,
+    metric="Test_Acc",
+    silent=False,
+    workers=None,
+    modelOptions=None,
+    dtype=np.float64,
+    stackSize=None,
+    resultsFile=None,
+    blasThreads=None,
+):
+
+    # Var inits
+    picker = HPicker()
+    store = ResultsStore(list(hRanges.keys()) + ["Budget"], epochs, resultsFile)
+    costs = {}
+    params = {}
+    results = {}
+
+    # Cast the data once up front rather than once per trial
+    # Lazy HDF5Dataset inputs can't be shared with worker processes or stacked, so those are trained serially
+    data, lazy = castSweepData(data, dtype)
+    if lazy:
+        workers, stackSize = None, None
+    modelOptions = dict(modelOptions or {}, dtype=dtype)
+    trainingData, trainingLabels, testData, testLabels = data
+
+    # By default use as many rungs as it takes to narrow the field down to a single configuration
+    if rungs is None:
+        rungs = 1
+        while eta ** (rungs - 1) < epochs:
+            rungs = rungs + 1
+
+    print("\n*** Starting model training")
+
+    trials = [
+        pickTrial(picker, hRanges, epoch, layerSizes, trainingData, trainingLabels)
+        for epoch in range(epochs)
+    ]
+    active = list(range(epochs))
+    workers, blasThreads = scheduleWorkers(data, trials, workers, blasThreads, modelOptions)
+
+    for rung in range(rungs):
+        # Give each active trial its share of its full iteration count for this rung
+        fraction = float(eta) ** (rung - (rungs - 1))
+        rungTrials = []
+        for epoch in active:
+            hparams = copy.deepcopy(trials[epoch])
+            hparams["Iterations"] = max(1, int(round(trials[epoch]["Iterations"] * fraction)))
+            rungTrials.append(hparams)
+
+        if silent is not True:
+            print("*** Rung", rung, ":", len(active), "models at", round(fraction * 100, 1), "% of their iterations")
+
+        for epoch, hparams, result in zip(
+            active,
+            rungTrials,
+            trainTrials(
+                data, rungTrials, workers, modelOptions, silent, stackSize, blasThreads=blasThreads
+            ),
+        ):
+            results[epoch] = (hparams["Iterations"], result)
+
+        # Promote the best 1/eta of the trials to the next rung
+        if rung < rungs - 1:
+            scores = [results[epoch][1][2][metric] for epoch in active]
+            order = np.argsort(scores, kind="stable")
+            if metric != "Final_Cost":
+                order = order[::-1]
+            keep = max(1, len(active) // eta)
+            active = sorted(active[i] for i in order[:keep])
+
+    # Add model results to the results store in trial order; "Iterations" keeps the full count requested
+    for epoch in range(epochs):
+        budget, (params[epoch], costs[epoch], hparams) = results[epoch]
+        hparams["Iterations"] = trials[epoch]["Iterations"]
+        hparams["Budget"] = budget
+        store.append(epoch, hparams)
+    store.close()
+
+    print("*** Done!\n")
+
+    # Sort the dataframe so the trials that reached the largest budget come first
+    resultsDF = store.toDataFrame().sort_values(
+        by=["Budget", "Descending_Graph", "Test_Acc"], ascending=False
+    )
+
+    return resultsDF, params, costs
+
+
+# Train the same model once per dtype and compare the throughput and accuracy of each precision
+# 'data' is the usual [trainingData, trainingLabels, testData, testLabels] list
+def benchmarkDtypes(
+    data,
+    dims,
+    numIterations,
+    learningRate,
+    lamb,
+    batchSize,
+    dropProb,
+    dtypes=(np.float64, np.float32),
+    **modelOptions
+):
+    rows = []
+
+    for dtype in dtypes:
+        trainingData, trainingLabels, testData, testLabels = [
+            np.asarray(array, dtype=dtype) for array in data
+        ]
+
+        # Time the training run on its own; the predictions below aren't part of the throughput figure
+        start = time.perf_counter()
+        params, costs, _ = model(
+            data=trainingData,
+            labels=trainingLabels,
+            dims=dims,
+            numIterations=numIterations,
+            learningRate=learningRate,
+            lamb=lamb,
+            batchSize=batchSize,
+            dropProb=dropProb,
+            dtype=dtype,
+            **modelOptions
+        )
+        seconds = time.perf_counter() - start
+
+        rows.append(
+            {
+                "dtype": np.dtype(dtype).name,
+                "Seconds": seconds,
+                "Samples_Per_Sec": trainingData.shape[1] * (numIterations + 1) / seconds,
+                "Final_Cost": float(costs[-1]),
+                "Train_Acc": predict(trainingData, params, trainingLabels)["accuracy"],
+                "Test_Acc": predict(testData, params, testLabels)["accuracy"],
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
 # Save a set of model parameters to disk
 def writeParamsToDisk(fileName, params):
     # Create the HDF5 container and write params
@@ -303,6 +1225,87 @@ def readParamsFromDisk(fileName):
     return params
 
 
+# Sweep directory for checkpointing runModels()
+# Every trial's picked hyperparams are saved to "plan.json" before the trial is trained, and every finished trial's
+# results (hparams, cost curve, and params) to its own "trial<epoch>.hdf5" file.  Each file is written under a
+# temporary name and then renamed into place, so a sweep that is killed part way through never leaves a partly
+# written file behind; only the trials still training are lost.  A resumed sweep reuses the saved picks and loads
+# the finished trials rather than training them again.
+class SweepCheckpoint:
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.planned = {}
+        if path.exists(self.fileName("plan.json")):
+            with open(self.fileName("plan.json")) as planFile:
+                self.planned = {int(epoch): hparams for epoch, hparams in json.load(planFile).items()}
+
+        self.finished = set()
+        for name in os.listdir(directory):
+            if name.startswith("trial") and name.endswith(".hdf5"):
+                self.finished.add(int(name[len("trial") : -len(".hdf5")]))
+
+    # Full path of a file in the sweep directory
+    def fileName(self, name):
+        return path.join(self.directory, name)
+
+    # Write a file under a temporary name with 'write(tempName)', then rename it into place
+    def replace(self, name, write):
+        tempName = self.fileName(name + ".tmp")
+        write(tempName)
+        os.replace(tempName, self.fileName(name))
+
+    # JSON for hyperparams; Numpy scalars are stored as plain Python values
+    @staticmethod
+    def toJSON(hparams):
+        return json.dumps(hparams, default=lambda value: value.item())
+
+    # Return the saved picks for a round of trials, saving the new picks of any trial that has none
+    def plan(self, trials):
+        planned = []
+        for hparams in trials:
+            if hparams["Epoch"] not in self.planned:
+                self.planned[hparams["Epoch"]] = copy.deepcopy(hparams)
+            planned.append(copy.deepcopy(self.planned[hparams["Epoch"]]))
+
+        def write(tempName):
+            with open(tempName, "w") as planFile:
+                planFile.write(self.toJSON(self.planned))
+
+        self.replace("plan.json", write)
+
+        return planned
+
+    # True if the trial's results are already saved
+    def isFinished(self, epoch):
+        return epoch in self.finished
+
+    # Save a finished trial's results
+    def save(self, epoch, result):
+        params, costs, hparams = result
+
+        def write(tempName):
+            with h5py.File(tempName, "w") as trialFile:
+                trialFile.create_dataset("costs", data=np.asarray(costs, dtype=np.float64))
+                for key in params.keys():
+                    trialFile.create_dataset("params/" + key, data=params[key])
+                trialFile.attrs["hparams"] = self.toJSON(hparams)
+
+        self.replace("trial" + str(epoch) + ".hdf5", write)
+        self.finished.add(epoch)
+
+    # Load a finished trial's results; returns (params, costs, hparams) like trainTrial()
+    def load(self, epoch):
+        with h5py.File(self.fileName("trial" + str(epoch) + ".hdf5"), "r") as trialFile:
+            params = {key: trialFile["params"][key][()] for key in trialFile["params"]}
+            costs = list(trialFile["costs"][()])
+            hparams = json.loads(trialFile.attrs["hparams"])
+
+        return params, costs, hparams
+
+
 def createMiniBatches(data, labels, batchSize, seed):
     m = data.shape[1]
     miniBatches = []
@@ -333,19 +1336,237 @@ def createMiniBatches(data, labels, batchSize, seed):
     return miniBatches
 
 
+# Run a batch generator on a background thread so the next batch is ready while the current one trains
+# The generator must rotate through at least three buffers:  the consumer holds one, the queue holds another,
+# and the thread fills a third
+def prefetchBatches(batches):
+    ready = queue.Queue(maxsize=1)
+    stop = threading.Event()
+
+    # Background producer; errors are handed to the consumer so they aren't lost with the thread
+    def produce():
+        try:
+            for batch in batches:
+                while not stop.is_set():
+                    try:
+                        ready.put(batch, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as error:
+            ready.put(error)
+        ready.put(None)
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+
+    try:
+        while True:
+            batch = ready.get()
+            if batch is None:
+                break
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        # Unblock the producer if it is waiting on a full queue
+        while worker.is_alive():
+            try:
+                ready.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+# Serve shuffled mini batches without materializing a shuffled copy of the data set
+# Only the index array is shuffled; each batch is gathered into a reusable buffer, so a yielded batch is only
+# valid until the next one is requested.  Set 'prefetch' to gather the next batch on a background thread.
+class MiniBatchLoader:
+
+    def __init__(self, data, labels, batchSize, prefetch=False):
+        self.data = data
+        self.labels = labels
+        self.m = data.shape[1]
+        self.batchSize = min(batchSize, self.m)
+        self.count = math.ceil(self.m / self.batchSize)
+        self.prefetch = prefetch
+
+        # loadData() builds its matrices by transposing the image arrays, which leaves them column-major.  np.take()
+        # along the columns of a column-major matrix is very slow, so gather whole rows of the transpose instead.
+        self.columnMajor = data.flags.f_contiguous and not data.flags.c_contiguous
+
+        # Prefetching needs three buffers (see prefetchBatches())
+        slots = 3 if prefetch else 1
+        self.buffers = [self.makeBuffer(self.batchSize) for _ in range(slots)]
+        remainder = self.m % self.batchSize
+        self.partial = self.makeBuffer(remainder) if remainder else None
+
+    # Create the data and label buffers for a batch of 'size' records
+    def makeBuffer(self, size):
+        return (
+            np.empty(
+                (self.data.shape[0], size),
+                dtype=self.data.dtype,
+                order="F" if self.columnMajor else "C",
+            ),
+            np.empty((self.labels.shape[0], size), dtype=self.labels.dtype),
+        )
+
+    # Gather batch number 'k' of a given permutation into its buffer
+    def gather(self, k, permutation):
+        index = permutation[k * self.batchSize : (k + 1) * self.batchSize]
+        if len(index) < self.batchSize:
+            batchData, batchLabels = self.partial
+        else:
+            batchData, batchLabels = self.buffers[k % len(self.buffers)]
+
+        if self.columnMajor:
+            np.take(self.data.T, index, axis=0, out=batchData.T, mode="clip")
+        else:
+            np.take(self.data, index, axis=1, out=batchData, mode="clip")
+        np.take(self.labels, index, axis=1, out=batchLabels, mode="clip")
+
+        return batchData, batchLabels
+
+    # Return the mini batches for one pass over the data; same shuffle as createMiniBatches() for a given seed
+    # Pass a Generator as 'rng' to draw the shuffle from it in place of the reseeded global RNG
+    def batches(self, seed, rng=None):
+        if rng is not None:
+            permutation = rng.permutation(self.m)
+        else:
+            np.random.seed(seed)
+            permutation = np.random.permutation(self.m)
+
+        batches = (self.gather(k, permutation) for k in range(self.count))
+
+        return prefetchBatches(batches) if self.prefetch else batches
+
+
+# Serve shuffled mini batches straight from an HDF5Dataset
+# Blocks of contiguous records are read from disk in a shuffled order, and the records inside each block are
+# shuffled before being normalized into the batch buffers.  Only one block and a few batches are ever in memory.
+class HDF5BatchLoader:
+
+    def __init__(self, dataset, batchSize, prefetch=False):
+        self.dataset = dataset
+        self.m = dataset.m
+        self.batchSize = min(batchSize, self.m)
+        self.count = math.ceil(self.m / self.batchSize)
+        self.blockSize = dataset.blockSize
+        self.blockCount = math.ceil(self.m / self.blockSize)
+        self.prefetch = prefetch
+
+        # Reusable buffers:  the raw block, the gathered block rows, and the batches (three when prefetching)
+        self.raw = np.empty(
+            (self.blockSize,) + dataset.data.shape[1:], dtype=dataset.data.dtype
+        )
+        self.rows = np.empty((self.blockSize, dataset.features), dtype=dataset.data.dtype)
+        slots = 3 if prefetch else 1
+        self.buffers = [
+            (
+                np.empty((dataset.features, self.batchSize), dtype=dataset.dtype),
+                np.empty((dataset.labels.shape[0], self.batchSize), dtype=dataset.dtype),
+            )
+            for _ in range(slots)
+        ]
+
+    # Generate the batches for a given block order and set of in-block permutations
+    def generate(self, blockOrder, rowOrders):
+        k = 0
+        filled = 0
+        batchData, batchLabels = self.buffers[0]
+
+        for block, order in zip(blockOrder, rowOrders):
+            start = block * self.blockSize
+            stop = min(start + self.blockSize, self.m)
+            raw = self.dataset.readRaw(start, stop, self.raw)
+            taken = 0
+
+            while taken < len(order):
+                count = min(len(order) - taken, self.batchSize - filled)
+                rows = order[taken : taken + count]
+
+                # Gather the shuffled rows, then normalize them into the batch columns
+                np.take(raw, rows, axis=0, out=self.rows[:count], mode="clip")
+                np.divide(
+                    self.rows[:count].T,
+                    255.,
+                    out=batchData[:, filled : filled + count],
+                    dtype=self.dataset.dtype,
+                )
+                batchLabels[:, filled : filled + count] = self.dataset.labels[
+                    :, start + rows
+                ]
+                taken = taken + count
+                filled = filled + count
+
+                if filled == self.batchSize:
+                    yield batchData, batchLabels
+                    k = k + 1
+                    filled = 0
+                    batchData, batchLabels = self.buffers[k % len(self.buffers)]
+
+        # Next take the final grouping of records that are left over
+        if filled > 0:
+            yield batchData[:, :filled], batchLabels[:, :filled]
+
+    # Return the mini batches for one pass over the data set
+    # Pass a Generator as 'rng' to draw the shuffle from it in place of the reseeded global RNG
+    def batches(self, seed, rng=None):
+        # Draw the whole shuffle up front so the RNG isn't touched from the prefetch thread
+        if rng is None:
+            np.random.seed(seed)
+            rng = np.random
+        blockOrder = rng.permutation(self.blockCount)
+        rowOrders = [
+            rng.permutation(min(self.blockSize, self.m - block * self.blockSize))
+            for block in blockOrder
+        ]
+
+        batches = self.generate(blockOrder, rowOrders)
+
+        return prefetchBatches(batches) if self.prefetch else batches
+
+
 #############################################
 ##### N-LAYER NEURAL NETWORK MODEL CODE #####
 #############################################
 
+# Independent, reproducible random number streams derived from one root seed
+# Every stream is keyed by a trial number, a purpose, and any further keys (e.g. the layer or iteration number), and
+# is built from its own numpy.random.SeedSequence.  A trial gets the same numbers no matter which order, thread, or
+# process it runs in, and nothing touches the global np.random/random state.
+class RandomStreams:
+
+    purposes = {"picker": 0, "layers": 1, "init": 2, "batches": 3, "dropout": 4}
+
+    def __init__(self, seed=10, trial=0):
+        self.seed = seed
+        self.trial = trial
+
+    # Return a new Generator for a purpose and any further keys, e.g. generator("init", layer)
+    def generator(self, purpose, *keys):
+        key = (int(self.trial), self.purposes[purpose]) + tuple(int(k) for k in keys)
+        return np.random.Generator(
+            np.random.PCG64(np.random.SeedSequence(self.seed, spawn_key=key))
+        )
+
+
 # Define the dimensions of the model
-def defineDimensions(data, labels, layerSizes):
+# Pass a Generator as 'rng' to draw the layer sizes from it in place of the 'random' module
+def defineDimensions(data, labels, layerSizes, rng=None):
     nnDims = {}
 
     nnDims["hiddenLayerSizes"] = []
 
     # layers tuple w/ 3 values:  number of hidden units, layer cell count min, layer cell count max
     for i in range(0, layerSizes[0]):
-        layerSize = random.randint(layerSizes[1], layerSizes[2])
+        if rng is not None:
+            layerSize = int(rng.integers(layerSizes[1], layerSizes[2] + 1))
+        else:
+            layerSize = random.randint(layerSizes[1], layerSizes[2])
         nnDims["hiddenLayerSizes"].append(layerSize)
 
     nnDims["numberInputs"] = data.shape[0]
@@ -355,7 +1576,9 @@ def defineDimensions(data, labels, layerSizes):
 
 
 #  Initialize model params (i.e. W and b)
-def initilizeParameters(dimensionDict):
+#  The random draws are always made in float64 and then cast to 'dtype', so the initial weights match across dtypes
+#  Pass a RandomStreams object as 'streams' to give every layer its own independent draw
+def initilizeParameters(dimensionDict, dtype=np.float64, streams=None):
 
     params = {}
     lastDimSize = dimensionDict["numberInputs"]
@@ -365,9 +1588,13 @@ def initilizeParameters(dimensionDict):
         bName = "b" + str(index)
 
         # Initialize utilizing "He Initialization"
-        np.random.seed(10)  # Yes, this has to be done every time...  :(
-        params[wName] = np.random.randn(size, lastDimSize) * np.sqrt(2 / lastDimSize)
-        params[bName] = np.zeros((size, 1))
+        if streams is not None:
+            draw = streams.generator("init", index).standard_normal((size, lastDimSize))
+        else:
+            np.random.seed(10)  # Yes, this has to be done every time...  :(
+            draw = np.random.randn(size, lastDimSize)
+        params[wName] = (draw * np.sqrt(2 / lastDimSize)).astype(dtype)
+        params[bName] = np.zeros((size, 1), dtype=dtype)
         lastDimSize = size
 
     # add final output layer
@@ -375,12 +1602,15 @@ def initilizeParameters(dimensionDict):
     bName = "b" + str(len(dimensionDict["hiddenLayerSizes"]) + 1)
 
     # Initialize utilizing "He Initialization"
-    np.random.seed(10)  # Yes, this has to be done every time...  :(
-    params[wName] = np.random.randn(
-        dimensionDict["numberOutputs"], lastDimSize
-    ) * np.sqrt(2 / lastDimSize)
+    shape = (dimensionDict["numberOutputs"], lastDimSize)
+    if streams is not None:
+        draw = streams.generator("init", len(dimensionDict["hiddenLayerSizes"]) + 1).standard_normal(shape)
+    else:
+        np.random.seed(10)  # Yes, this has to be done every time...  :(
+        draw = np.random.randn(*shape)
+    params[wName] = (draw * np.sqrt(2 / lastDimSize)).astype(dtype)
 
-    params[bName] = np.zeros((dimensionDict["numberOutputs"], 1))
+    params[bName] = np.zeros((dimensionDict["numberOutputs"], 1), dtype=dtype)
 
     return params
 
@@ -398,10 +1628,10 @@ def initilizeAdamParameters(params):
     s = {}
 
     for i in range(m):
-        v["dw" + str(i + 1)] = np.zeros((params["w" + str(i + 1)].shape))
-        v["db" + str(i + 1)] = np.zeros((params["b" + str(i + 1)].shape))
-        s["dw" + str(i + 1)] = np.zeros((params["w" + str(i + 1)].shape))
-        s["db" + str(i + 1)] = np.zeros((params["b" + str(i + 1)].shape))
+        v["dw" + str(i + 1)] = np.zeros_like(params["w" + str(i + 1)])
+        v["db" + str(i + 1)] = np.zeros_like(params["b" + str(i + 1)])
+        s["dw" + str(i + 1)] = np.zeros_like(params["w" + str(i + 1)])
+        s["db" + str(i + 1)] = np.zeros_like(params["b" + str(i + 1)])
 
     return v, s
 
@@ -411,13 +1641,73 @@ def relu(x):
     return x * (x > 0)
 
 
-# Define ReLu derivative
+# Define ReLu derivative (in the same precision as the input)
 def dRelu(x):
-    return 1. * (x > 0)
+    return (x > 0).astype(x.dtype)
+
+
+# Dropout masks drawn from a numpy.random.Generator stream
+# Unlike the reseeded np.random.rand() draw in forwardPropagation(), every draw makes a fresh mask.  A value is kept
+# when a 16 bit random integer falls under dropProb * 65536, which is much cheaper than drawing float64 uniforms.
+# Masks are stored as booleans (one byte per value), or with 'packed' as one bit per value.  A stored mask is the
+# dropout mask and the ReLu gate combined, so the backward pass can reuse it as is.  apply() multiplies by the mask
+# and then by the 1/dropProb scale, both in place.  Generator.integers() can't draw into an existing array, so the
+# 16 bit draw is the only array allocated per pass; it is still about twice as fast as drawing float32 uniforms into
+# a reused buffer.
+# 'seed' can also be a Generator (e.g. from RandomStreams) to draw from
+class DropoutMasks:
+
+    levels = 65536
+
+    def __init__(self, dropProb, seed=10, packed=False):
+        self.dropProb = dropProb
+        self.scale = 1 / dropProb
+        self.threshold = int(round(dropProb * self.levels))
+        self.packed = packed
+        self.rng = np.random.default_rng(seed)
+        self.scratch = {}
+
+    # Draw a fresh boolean keep mask with the given shape
+    def draw(self, shape, out=None):
+        if self.threshold >= self.levels:
+            out = np.empty(shape, dtype=np.bool_) if out is None else out
+            out[...] = True
+            return out
+
+        draw = self.rng.integers(0, self.levels, size=shape, dtype=np.uint16)
+        return np.less(draw, self.threshold, out=out)
+
+    # Draw a fresh mask and combine it with the ReLu gate of 'z':  (z > 0) & keep
+    # The (z > 0) test is written into a scratch array that is kept per shape, so it doesn't allocate a temporary
+    def gate(self, z, out=None):
+        if z.shape not in self.scratch:
+            self.scratch[z.shape] = np.empty(z.shape, dtype=np.bool_)
+
+        gate = self.draw(z.shape, out)
+        positive = np.greater(z, 0, out=self.scratch[z.shape])
+        return np.logical_and(gate, positive, out=gate)
+
+    # Multiply 'x' by a gate, then by the 1/dropProb scale (two in-place passes over 'out')
+    def apply(self, x, gate, out=None):
+        out = np.multiply(x, gate, out=out)
+        if self.scale != 1:
+            out *= self.scale
+        return out
+
+    # Convert a gate to the form it's stored in between the forward and backward passes
+    def pack(self, gate):
+        return np.packbits(gate, axis=-1) if self.packed else gate
+
+    # Convert a stored gate with 'm' columns back to a boolean mask
+    def unpack(self, stored, m):
+        if self.packed:
+            return np.unpackbits(stored, axis=-1, count=m).view(np.bool_)
+        return stored
 
 
 # Perform forward propogation
-def forwardPropagation(data, params, dropProb):
+# Pass a DropoutMasks object in 'masks' to draw fresh, compact dropout masks in place of the reseeded float64 ones
+def forwardPropagation(data, params, dropProb, masks=None):
 
     # Init vars
     numLayers = (len(params)) // 2
@@ -441,6 +1731,11 @@ def forwardPropagation(data, params, dropProb):
             # last layer; sigmoid activation
             cache["a" + str(i)] = 1 / (1 + np.exp(-(z)))
             assert cache["a" + str(i)].shape == z.shape
+        elif masks is not None:
+            # Hidden layer; ReLu activation and dropout with a single stored gate
+            gate = masks.gate(z)
+            cache["a" + str(i)] = masks.apply(z, gate, out=z)
+            cache["dropMask" + str(i)] = masks.pack(gate)
         else:
             # Hidden layer; ReLu activation
             cache["a" + str(i)] = relu(z)
@@ -461,10 +1756,20 @@ def forwardPropagation(data, params, dropProb):
     return cache
 
 
+# Sum of the squared weights for L2 regularization
+# np.vdot() of a flattened weight matrix with itself is a single BLAS pass with no temporary array
+def regularizationSum(params):
+    regSums = 0
+    for i in range(1, (len(params) // 2) + 1):
+        w = params["w" + str(i)].reshape(-1)
+        regSums = regSums + np.vdot(w, w)
+
+    return regSums
+
+
 # Calculate the cost of the model (includes L2 regularization)
 def calculateCost(labels, params, cache, lamb):
     # Define vars to make reading and writing the formulas easier below...
-    regSums = 0
     m = labels.shape[1]
     aL = cache["a" + str((len(params)) // 2)]
 
@@ -473,9 +1778,7 @@ def calculateCost(labels, params, cache, lamb):
         (labels * np.log(aL)) + ((1 - labels) * np.log(1 - aL))
     )
 
-    layers = (len(params) // 2) + 1
-    for i in range(1, layers):
-        regSums = regSums + np.sum(np.square(params["w" + str(i)]))
+    regSums = regularizationSum(params)
 
     l2RegularizationCost = (1 / m) * (lamb / 2) * regSums
     finalCost = crossEntropyCost + l2RegularizationCost
@@ -497,7 +1800,8 @@ def linearBackProp(dz, aPrev, w, b, lamb):
 
 
 # Perform backward propogation
-def backwardPropagation(labels, cache, params, lamb, dropProb):
+# 'masks' must be the DropoutMasks object (if any) that was passed to forwardPropagation()
+def backwardPropagation(labels, cache, params, lamb, dropProb, masks=None):
 
     # Init variables
     grads = {}
@@ -534,9 +1838,13 @@ def backwardPropagation(labels, cache, params, lamb, dropProb):
         # Apply backprop with dropout regularization and calc grads; breaking up the calc steps for readability
         # dz = np.dot(params[wBefore].T, dzBefore) * dRelu(cache[a])
         dz = np.dot(params[wBefore].T, dzBefore)
-        dz = dz * cache[dropMask]
-        dz = dz / dropProb
-        dz = dz * dRelu(cache[a])
+        if masks is not None:
+            # The stored gate already holds the ReLu derivative
+            dz = masks.apply(dz, masks.unpack(cache[dropMask], m), out=dz)
+        else:
+            dz = dz * cache[dropMask]
+            dz = dz / dropProb
+            dz = dz * dRelu(cache[a])
         grads[dw], grads[db] = linearBackProp(
             dz, cache[aPrev], params[w], params[b], lamb
         )
@@ -609,7 +1917,554 @@ def updateParamsAdam(
     return params, v, s
 
 
+# Lay a dict of arrays out in one contiguous buffer; returns the buffer and a dict of per-key views into it
+# Keys are prefixed with 'prefix' (e.g. "d" turns "w1" into "dw1"), and the values are copied unless 'copy' is False
+def flattenParameters(params, prefix="", copy=True):
+    dtype = np.result_type(*params.values())
+    flat = np.zeros(sum(value.size for value in params.values()), dtype=dtype)
+    views = {}
+    offset = 0
+
+    for key, value in params.items():
+        views[prefix + key] = flat[offset : offset + value.size].reshape(value.shape)
+        if copy:
+            views[prefix + key][...] = value
+        offset = offset + value.size
+
+    return flat, views
+
+
+# Adam optimizer over flat, contiguous buffers
+# The params, grads, v, and s dicts are views into one buffer each, so the optimizer step is a handful of
+# vectorized operations over the whole model instead of a dozen small ones per layer
+class FlatAdam:
+
+    def __init__(self, params):
+        self.flatParams, self.params = flattenParameters(params)
+        self.flatGrads, self.grads = flattenParameters(params, "d", copy=False)
+        self.flatV, self.v = flattenParameters(params, "d", copy=False)
+        self.flatS, self.s = flattenParameters(params, "d", copy=False)
+        self.scratch = np.empty_like(self.flatParams)
+
+    # Copy a grads dict (e.g. from backwardPropagation()) into the flat grads buffer
+    def loadGrads(self, grads):
+        if grads is self.grads:
+            return
+        for key, value in grads.items():
+            self.grads[key][...] = value
+
+    # Update the model params using Adam; same math as updateParamsAdam()
+    def step(self, t, learningRate, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        grads = self.flatGrads
+        scratch = self.scratch
+
+        # Moving average of the gradients
+        self.flatV *= beta1
+        np.multiply(grads, 1 - beta1, out=scratch)
+        self.flatV += scratch
+
+        # Moving average of the squared gradients
+        self.flatS *= beta2
+        np.square(grads, out=scratch)
+        scratch *= 1 - beta2
+        self.flatS += scratch
+
+        # Bias-corrected update:  params -= learningRate * vCorrected / sqrt(sCorrected + epsilon)
+        np.divide(self.flatS, 1 - beta2 ** t, out=scratch)
+        scratch += epsilon
+        np.sqrt(scratch, out=scratch)
+        np.divide(self.flatV, scratch, out=scratch)
+        scratch *= learningRate / (1 - beta1 ** t)
+        self.flatParams -= scratch
+
+        return self.params
+
+
+# Fused forward/backward propagation engine
+# Works like forwardPropagation() + backwardPropagation(), but preallocates the per-layer activation and gradient
+# buffers once per batch shape and then runs every pass with in-place NumPy operations (i.e. out=)
+# Pass 'grads' (e.g. FlatAdam.grads) to have the gradients written into an existing set of containers
+# The output layer is left in logit space (the cache holds z, not the sigmoid of z); cost() and backward() work
+# straight from the logits, which avoids the log(0) NaNs of calculateCost() and the separate sigmoid pass
+class FusedNetwork:
+
+    def __init__(self, params, dropProb=1, grads=None, masks=None):
+        self.layers = len(params) // 2
+        self.dropProb = dropProb
+        self.masks = masks
+        self.shapes = [params["w" + str(i)].shape for i in range(1, self.layers + 1)]
+        self.dtype = params["w1"].dtype
+        self.buffers = {}
+
+        # Gradient containers don't depend on the batch size, so they can be shared by all the buffer sets
+        self.grads = {} if grads is None else grads
+        self.scratch = {}
+        for i, shape in enumerate(self.shapes, start=1):
+            if grads is None:
+                self.grads["dw" + str(i)] = np.empty(shape, dtype=self.dtype)
+                self.grads["db" + str(i)] = np.empty((shape[0], 1), dtype=self.dtype)
+            self.scratch["w" + str(i)] = np.empty(shape, dtype=self.dtype)
+
+    # Create (or reuse) the activation, gradient, and dropout buffers for a given number of batch records
+    def getBuffers(self, m):
+        if m in self.buffers:
+            return self.buffers[m]
+
+        buffers = {"cache": {}, "gate": {}, "dz": {}, "exp": np.empty((self.shapes[-1][0], m), dtype=self.dtype)}
+        for i, shape in enumerate(self.shapes, start=1):
+            buffers["cache"]["a" + str(i)] = np.empty((shape[0], m), dtype=self.dtype)
+            buffers["dz"][i] = np.empty((shape[0], m), dtype=self.dtype)
+
+            if i < self.layers and self.masks is not None:
+                # Fresh masks are drawn on every pass; the gate is kept as a compact boolean array
+                buffers["gate"][i] = np.empty((shape[0], m), dtype=np.bool_)
+            elif i < self.layers:
+                # The mask is identical on every pass because the RNG is reseeded before each draw, so we only need
+                # to build it once per batch shape; the 1/dropProb scaling is folded into the stored mask
+                np.random.seed(10)  # Yes, this has to be done every time...  :(
+                mask = np.random.rand(shape[0], m) < self.dropProb
+                buffers["gate"][i] = np.empty((shape[0], m), dtype=self.dtype)
+                buffers["mask" + str(i)] = (mask / self.dropProb).astype(self.dtype)
+
+        self.buffers[m] = buffers
+        return buffers
+
+    # Perform forward propogation; returns a cache laid out like the one from forwardPropagation(), except that the
+    # output layer's entry holds the logits
+    def forward(self, data, params):
+        buffers = self.getBuffers(data.shape[1])
+        cache = buffers["cache"]
+        cache["a0"] = aPrev = data
+        self.expFresh = False
+
+        for i in range(1, self.layers + 1):
+            a = cache["a" + str(i)]
+
+            # Linear calculations written straight into the activation buffer
+            np.dot(params["w" + str(i)], aPrev, out=a)
+            a += params["b" + str(i)]
+
+            if i == self.layers:
+                # Last layer; the sigmoid is folded into cost() and backward()
+                pass
+            elif self.masks is not None:
+                # Hidden layer; ReLu activation and a freshly drawn dropout mask share a single gate
+                self.masks.apply(a, self.masks.gate(a, out=buffers["gate"][i]), out=a)
+            else:
+                # Hidden layer; ReLu activation and dropout share a single gate:  (z > 0) * mask / dropProb
+                gate = buffers["gate"][i]
+                np.greater(a, 0, out=gate)
+                gate *= buffers["mask" + str(i)]
+                a *= gate
+
+            aPrev = a
+
+        return cache
+
+    # exp(-|z|) for the output logits of the last forward() pass; shared by cost() and backward()
+    def expTerm(self, m):
+        buffers = self.buffers[m]
+        e = buffers["exp"]
+        if not self.expFresh:
+            np.abs(buffers["cache"]["a" + str(self.layers)], out=e)
+            np.negative(e, out=e)
+            np.exp(e, out=e)
+            self.expFresh = True
+        return e
+
+    # Calculate the cost of the last forward() pass (includes L2 regularization); same value as calculateCost()
+    # Cross entropy of a sigmoid in logit space:  max(z, 0) - y * z + log(1 + exp(-|z|))
+    def cost(self, labels, params, lamb):
+        m = labels.shape[1]
+        z = self.buffers[m]["cache"]["a" + str(self.layers)]
+        e = self.expTerm(m)
+
+        crossEntropyCost = (
+            np.sum(np.maximum(z, 0)) - np.vdot(labels, z) + np.sum(np.log1p(e))
+        ) / m
+
+        return crossEntropyCost + (1 / m) * (lamb / 2) * regularizationSum(params)
+
+    # Perform backward propogation against the last forward() pass; returns the (reused) gradient containers
+    def backward(self, labels, params, lamb):
+        m = labels.shape[1]
+        buffers = self.buffers[m]
+        cache = buffers["cache"]
+
+        # Initialize backprop:  dz for layer L is sigmoid(z) - y, with the sigmoid taken from exp(-|z|) so it can't
+        # overflow:  1 / (1 + e) where z >= 0 and e / (1 + e) where z < 0
+        z = cache["a" + str(self.layers)]
+        e = self.expTerm(m)
+        dz = buffers["dz"][self.layers]
+        np.add(e, 1, out=dz)
+        np.reciprocal(dz, out=dz)
+        np.multiply(dz, e, out=dz, where=z < 0)
+        dz -= labels
+
+        for i in reversed(range(1, self.layers + 1)):
+            dw = self.grads["dw" + str(i)]
+            db = self.grads["db" + str(i)]
+            w = params["w" + str(i)]
+
+            # Linear back propogation:  dw = (dz . aPrev.T + lamb * w) / m  and  db = sum(dz) / m
+            np.dot(dz, cache["a" + str(i - 1)].T, out=dw)
+            if lamb != 0:
+                np.multiply(w, lamb, out=self.scratch["w" + str(i)])
+                dw += self.scratch["w" + str(i)]
+            dw *= 1 / m
+            np.sum(dz, axis=1, keepdims=True, out=db)
+            db *= 1 / m
+
+            # Push dz back through the weights and the ReLu/dropout gate of the layer below
+            if i > 1:
+                dzPrev = buffers["dz"][i - 1]
+                np.dot(w.T, dz, out=dzPrev)
+                if self.masks is not None:
+                    self.masks.apply(dzPrev, buffers["gate"][i - 1], out=dzPrev)
+                else:
+                    dzPrev *= buffers["gate"][i - 1]
+                dz = dzPrev
+
+        return self.grads
+
+
+# Stack of K same-shape networks trained together
+# Each layer's weights are held in a (K, n, nPrev) tensor, so forward/backward propagation and the Adam update for
+# all K models run as one set of batched np.matmul calls.  Each model keeps its own learning rate, lambda,
+# dropout probability, and Adam settings (passed as (K, 1, 1) arrays).
+class ModelStack:
+
+    def __init__(self, dims, dropProbs, dtype=np.float64):
+        # Every model starts from the same (seeded) He initialization, exactly as model() would give it
+        base = initilizeParameters(dims, dtype)
+        self.k = len(dropProbs)
+        self.layers = len(base) // 2
+        self.dtype = np.dtype(dtype)
+        self.dropProbs = np.asarray(dropProbs, dtype=self.dtype).reshape(-1, 1, 1)
+
+        # Params, grads, Adam state, and scratch space; one entry per layer for w and one for b
+        self.params = []
+        for i in range(1, self.layers + 1):
+            self.params.append(np.repeat(base["w" + str(i)][None], self.k, axis=0))
+        for i in range(1, self.layers + 1):
+            self.params.append(np.repeat(base["b" + str(i)][None], self.k, axis=0))
+        self.w = self.params[: self.layers]
+        self.b = self.params[self.layers :]
+        self.grads = [np.zeros_like(p) for p in self.params]
+        self.dw = self.grads[: self.layers]
+        self.db = self.grads[self.layers :]
+        self.v = [np.zeros_like(p) for p in self.params]
+        self.s = [np.zeros_like(p) for p in self.params]
+        self.scratch = [np.empty_like(p) for p in self.params]
+        self.buffers = {}
+
+    # Create (or reuse) the activation, gradient, and dropout buffers for a given number of batch records
+    def getBuffers(self, m):
+        if m in self.buffers:
+            return self.buffers[m]
+
+        buffers = {"a": [], "dz": [], "gate": [], "mask": []}
+        for i, w in enumerate(self.w, start=1):
+            buffers["a"].append(np.empty((self.k, w.shape[1], m), dtype=self.dtype))
+            buffers["dz"].append(np.empty((self.k, w.shape[1], m), dtype=self.dtype))
+
+            if i < self.layers:
+                # Same draw as forwardPropagation() makes, compared against each model's own dropout probability
+                np.random.seed(10)  # Yes, this has to be done every time...  :(
+                draw = np.random.rand(w.shape[1], m)
+                mask = (draw[None] < self.dropProbs) / self.dropProbs
+                buffers["gate"].append(np.empty((self.k, w.shape[1], m), dtype=self.dtype))
+                buffers["mask"].append(mask.astype(self.dtype))
+
+        self.buffers[m] = buffers
+        return buffers
+
+    # Perform forward propogation for every model; returns the (K, 1, m) output activations
+    def forward(self, data):
+        buffers = self.getBuffers(data.shape[1])
+        aPrev = data
+
+        for i in range(self.layers):
+            a = buffers["a"][i]
+            np.matmul(self.w[i], aPrev, out=a)
+            a += self.b[i]
+
+            if i == self.layers - 1:
+                # Last layer; sigmoid activation
+                np.negative(a, out=a)
+                np.exp(a, out=a)
+                a += 1
+                np.reciprocal(a, out=a)
+            else:
+                # Hidden layer; ReLu activation and dropout share a single gate
+                gate = buffers["gate"][i]
+                np.greater(a, 0, out=gate)
+                gate *= buffers["mask"][i]
+                a *= gate
+
+            aPrev = a
+
+        return aPrev
+
+    # Calculate the cost of every model (includes L2 regularization); returns a (K,) array
+    def cost(self, labels, lambdas):
+        m = labels.shape[1]
+        aL = self.buffers[m]["a"][-1][:, 0, :]
+
+        crossEntropyCost = (-1 / m) * np.sum(
+            (labels * np.log(aL)) + ((1 - labels) * np.log(1 - aL)), axis=1
+        )
+        regSums = sum(np.sum(np.square(w), axis=(1, 2)) for w in self.w)
+
+        return crossEntropyCost + (1 / m) * (lambdas.reshape(-1) / 2) * regSums
+
+    # Perform backward propogation for every model against the last forward() pass
+    def backward(self, data, labels, lambdas):
+        m = labels.shape[1]
+        buffers = self.buffers[m]
+
+        # Initialize backprop:  dz for layer L
+        dz = buffers["dz"][-1]
+        np.subtract(buffers["a"][-1], labels, out=dz)
+
+        for i in reversed(range(self.layers)):
+            # Linear back propogation:  dw = (dz . aPrev.T + lamb * w) / m  and  db = sum(dz) / m
+            if i == 0:
+                np.matmul(dz, data.T, out=self.dw[i])
+            else:
+                np.matmul(dz, buffers["a"][i - 1].transpose(0, 2, 1), out=self.dw[i])
+            np.multiply(self.w[i], lambdas, out=self.scratch[i])
+            self.dw[i] += self.scratch[i]
+            self.dw[i] *= 1 / m
+            np.sum(dz, axis=2, keepdims=True, out=self.db[i])
+            self.db[i] *= 1 / m
+
+            # Push dz back through the weights and the ReLu/dropout gate of the layer below
+            if i > 0:
+                dzPrev = buffers["dz"][i - 1]
+                np.matmul(self.w[i].transpose(0, 2, 1), dz, out=dzPrev)
+                dzPrev *= buffers["gate"][i - 1]
+                dz = dzPrev
+
+    # Update every model's params using Adam; same math as updateParamsAdam()
+    def step(self, t, learningRates, beta1s, beta2s, epsilons):
+        stepSizes = learningRates / (1 - beta1s ** t)
+        sCorrection = 1 - beta2s ** t
+
+        for p, g, v, s, scratch in zip(self.params, self.grads, self.v, self.s, self.scratch):
+            # Moving averages of the gradients and the squared gradients
+            v *= beta1s
+            np.multiply(g, 1 - beta1s, out=scratch)
+            v += scratch
+            s *= beta2s
+            np.square(g, out=scratch)
+            scratch *= 1 - beta2s
+            s += scratch
+
+            # Bias-corrected update
+            np.divide(s, sCorrection, out=scratch)
+            scratch += epsilons
+            np.sqrt(scratch, out=scratch)
+            np.divide(v, scratch, out=scratch)
+            scratch *= stepSizes
+            p -= scratch
+
+    # Pull the params of model 'k' out as a regular params dict
+    def getParams(self, k):
+        params = {}
+        for i in range(self.layers):
+            params["w" + str(i + 1)] = self.w[i][k].copy()
+            params["b" + str(i + 1)] = self.b[i][k].copy()
+        return params
+
+
+# Train K same-shape models at once with a ModelStack
+# The per-model hyperparams are lists (or scalars shared by every model); returns a list of
+# (params, costs, descendingGraph) tuples, one per model, matching what model() returns for each
+def modelStack(
+    data,
+    labels,
+    dims,
+    numIterations,
+    learningRates,
+    lambdas,
+    batchSize,
+    dropProbs,
+    beta1s=0.9,
+    beta2s=0.999,
+    epsilons=1e-8,
+    printCost=False,
+    prefetch=False,
+    dtype=np.float64,
+):
+
+    # Keep the data, labels, params, grads, and Adam state in a single floating point precision end to end
+    data = np.asarray(data, dtype=dtype)
+    labels = np.asarray(labels, dtype=dtype)
+    loader = MiniBatchLoader(data, labels, batchSize, prefetch)
+
+    # Per-model hyperparams as (K, 1, 1) arrays
+    k = len(learningRates)
+    perModel = lambda values: np.broadcast_to(
+        np.asarray(values, dtype=np.float64), (k,)
+    ).reshape(-1, 1, 1)
+    learningRates, lambdas = perModel(learningRates), perModel(lambdas)
+    beta1s, beta2s, epsilons = perModel(beta1s), perModel(beta2s), perModel(epsilons)
+
+    # Init vars
+    stack = ModelStack(dims, perModel(dropProbs).reshape(-1), dtype)
+    seed = 10  # mini-batch seed
+    t = 0  # Adam counter
+
+    costs = [[] for _ in range(k)]
+    descendingGraph = [True] * k
+
+    # For each training iteration
+    for i in range(0, numIterations + 1):
+
+        # Create the mini batches
+        seed = seed + 1  # assure we get a different batch composition each time through
+
+        for batchData, batchLabels in loader.batches(seed):
+            stack.forward(batchData)
+            cost = stack.cost(batchLabels, lambdas)
+            stack.backward(batchData, batchLabels, lambdas)
+
+            # Gradient descent parameter update with Adam
+            t = t + 1  # Update Adam counter
+            stack.step(t, learningRates, beta1s, beta2s, epsilons)
+
+        # Print the cost every N number of iterations
+        if printCost and i % 500 == 0:
+            print("Costs after iteration", str(i), "are", str(cost))
+
+        # Record the cost every N number of iterations
+        if i % 50 == 0:
+            for j in range(k):
+                if (len(costs[j]) != 0) and (cost[j] > costs[j][-1]):
+                    descendingGraph[j] = False
+                costs[j].append(cost[j])
+
+    return [(stack.getParams(j), costs[j], descendingGraph[j]) for j in range(k)]
+
+
+# Cumulative wall time and call counts for the phases of a training run (see model()'s 'profile' option)
+# Usage:  with timer.phase("forward"): ...   Phases don't nest, so a single timer object doubles as the context.
+class PhaseTimer:
+
+    phases = ["Batches", "Forward", "Cost", "Backward", "Update", "Record"]
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.phases, 0.0)
+        self.calls = dict.fromkeys(self.phases, 0)
+        self.samples = 0
+        self.started = time.perf_counter()
+        self.current = None
+        self.start = None
+
+    # Select the phase the next 'with' block is charged to
+    def phase(self, name):
+        self.current = name
+        return self
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.seconds[self.current] += time.perf_counter() - self.start
+        self.calls[self.current] += 1
+
+    # Time pulling each item out of an iterable (e.g. the mini batch generator) as its own phase
+    def iterate(self, name, iterable):
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.seconds[name] += time.perf_counter() - start
+                return
+            self.seconds[name] += time.perf_counter() - start
+            self.calls[name] += 1
+            yield item
+
+    # Summarize the timings as flat "Time_<phase>"/"Calls_<phase>" fields, ready to become resultsDF columns
+    # "Record_Overhead" is the share of the run spent recording (and checking) the cost:  the cost itself is only
+    # computed for the batches that are recorded or checked, so that's the "Cost" phase plus the "Record" phase
+    def summary(self):
+        total = time.perf_counter() - self.started
+        summary = {"Train_Seconds": total, "Samples_Per_Sec": self.samples / total}
+
+        for name in self.phases:
+            summary["Time_" + name] = self.seconds[name]
+            summary["Calls_" + name] = self.calls[name]
+        summary["Record_Overhead"] = (self.seconds["Cost"] + self.seconds["Record"]) / total
+
+        return summary
+
+
+# Does nothing; stands in for PhaseTimer when profiling is off
+class NoTimer:
+
+    def phase(self, name):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iterate(self, name, iterable):
+        return iterable
+
+
+# Early stopping rules for model(); pass the keyword arguments as model(..., earlyStop={...})
+#   patience   - stop after this many recorded costs (one every 50 iterations) without an improvement of 'minDelta'
+#   targetCost - stop once a recorded cost is at or below this value
+#   divergence - stop once a recorded cost grows past this multiple of the best recorded cost
+# A NaN or inf cost on any mini batch always aborts training once early stopping is turned on
+class EarlyStopping:
+
+    def __init__(self, patience=None, minDelta=0, targetCost=None, divergence=None):
+        self.patience = patience
+        self.minDelta = minDelta
+        self.targetCost = targetCost
+        self.divergence = divergence
+        self.best = np.inf
+        self.waited = 0
+
+    # Check a recorded cost; returns a stop reason or None
+    def check(self, cost):
+        if self.targetCost is not None and cost <= self.targetCost:
+            return "target"
+        if self.divergence is not None and cost > self.divergence * self.best:
+            return "diverged"
+
+        # Track the plateau
+        if cost < self.best - self.minDelta:
+            self.waited = 0
+        else:
+            self.waited = self.waited + 1
+        self.best = min(self.best, cost)
+        if self.patience is not None and self.waited >= self.patience:
+            return "plateau"
+
+        return None
+
+
 # Define the actual neural network classification model
+# 'earlyStop' turns on the EarlyStopping rules (e.g. {"patience": 10, "targetCost": 0.05})
+# Pass a dict as 'report' to have it filled with the reason training stopped ("Stop_Reason") and the last
+# iteration run ("Stopped_At")
+# 'dropoutSeed' draws fresh dropout masks from a DropoutMasks stream on every pass ('packedMasks' stores them as bits)
+# 'profile' adds the PhaseTimer timings (e.g. "Time_Forward", "Samples_Per_Sec") to the 'report' dict
+# The cost is only worked out when it's used:  for the iterations that are recorded (every 50) or, with early
+# stopping on, for every batch.  'evalCost' records the cost of the whole training set (no dropout, in chunks) in
+# place of the last mini batch's
+# 'rngSeed' draws the initial weights, the batch shuffles, and fresh dropout masks from RandomStreams(rngSeed, trial)
+# in place of the global RNG, so the run is reproducible in any thread or process
 def model(
     data,
     labels,
@@ -624,53 +2479,160 @@ def model(
     epsilon=1e-8,
     printCost=False,
     showGraph=False,
+    fused=False,
+    flat=False,
+    prefetch=False,
+    dtype=np.float64,
+    earlyStop=None,
+    report=None,
+    dropoutSeed=None,
+    packedMasks=False,
+    profile=False,
+    evalCost=False,
+    rngSeed=None,
+    trial=0,
 ):
 
+    # Mini batches are gathered into reusable buffers; optionally prefetched on a background thread
+    # An HDF5Dataset streams its batches from disk (its own dtype and labels are used in that case)
+    if isinstance(data, HDF5Dataset):
+        loader = data.loader(batchSize, prefetch)
+        dtype = data.dtype
+    else:
+        # Keep the data, labels, params, grads, and Adam state in a single floating point precision end to end
+        data = np.asarray(data, dtype=dtype)
+        labels = np.asarray(labels, dtype=dtype)
+        loader = MiniBatchLoader(data, labels, batchSize, prefetch)
+
     # Init vars
-    params = initilizeParameters(dims)
+    streams = RandomStreams(rngSeed, trial) if rngSeed is not None else None
+    params = initilizeParameters(dims, dtype, streams)
     seed = 10  # mini-batch seed
     t = 0  # Adam counter
     v, s = initilizeAdamParameters(params)
 
+    # Optionally keep the params, grads, and Adam state in flat buffers; 'params' becomes a dict of views
+    optimizer = None
+    if flat:
+        optimizer = FlatAdam(params)
+        params, v, s = optimizer.params, optimizer.v, optimizer.s
+
+    # Optionally draw fresh, compact dropout masks from a seeded Generator stream on every pass
+    masks = None
+    if streams is not None:
+        masks = DropoutMasks(dropProb, streams.generator("dropout"), packedMasks)
+    elif dropoutSeed is not None:
+        masks = DropoutMasks(dropProb, dropoutSeed, packedMasks)
+
+    # Optionally run the passes through the preallocated, in-place engine
+    engine = None
+    if fused:
+        engine = FusedNetwork(
+            params, dropProb, optimizer.grads if optimizer is not None else None, masks
+        )
+
     costs = []
     descendingGraph = True
+    stopper = EarlyStopping(**earlyStop) if earlyStop is not None else None
+    stopReason = "completed"
+    timer = PhaseTimer() if profile else NoTimer()
 
     # For each training iteration
     for i in range(0, numIterations + 1):
 
         # Create the mini batches
         seed = seed + 1  # assure we get a different batch composition each time through
-        miniBatches = createMiniBatches(data, labels, batchSize, seed)
+        logged = i % 50 == 0
+
+        shuffle = streams.generator("batches", i) if streams is not None else None
 
-        for batch in miniBatches:
+        for k, batch in enumerate(timer.iterate("Batches", loader.batches(seed, shuffle))):
 
             # Get a set of data and lable records
             (batchData, batchLabels) = batch
 
             # Forward propagation
-            cache = forwardPropagation(batchData, params, dropProb)
-
-            # Cost function
-            cost = calculateCost(batchLabels, params, cache, lamb)
+            with timer.phase("Forward"):
+                if engine is not None:
+                    cache = engine.forward(batchData, params)
+                else:
+                    cache = forwardPropagation(batchData, params, dropProb, masks)
+
+            # Cost function; only for the last batch of a logged iteration, or for every batch when the early
+            # stopping rules are watching for a blow up
+            lastBatch = k == loader.count - 1
+            if stopper is not None or (logged and lastBatch and not evalCost):
+                with timer.phase("Cost"):
+                    if engine is not None:
+                        cost = engine.cost(batchLabels, params, lamb)
+                    else:
+                        cost = calculateCost(batchLabels, params, cache, lamb)
+
+                # Abort as soon as the cost blows up; there's nothing left to learn from this trial
+                if stopper is not None and not np.isfinite(cost):
+                    stopReason = "nan"
+                    break
 
             # Backward  propagation
-            grads = backwardPropagation(batchLabels, cache, params, lamb, dropProb)
+            with timer.phase("Backward"):
+                if engine is not None:
+                    grads = engine.backward(batchLabels, params, lamb)
+                else:
+                    grads = backwardPropagation(
+                        batchLabels, cache, params, lamb, dropProb, masks
+                    )
 
             # Gradient descent parameter update with Adam
-            t = t + 1  # Update Adam counter
-            params, v, s = updateParamsAdam(
-                params, grads, v, s, t, learningRate, beta1, beta2, epsilon
-            )
+            with timer.phase("Update"):
+                t = t + 1  # Update Adam counter
+                if optimizer is not None:
+                    optimizer.loadGrads(grads)
+                    params = optimizer.step(t, learningRate, beta1, beta2, epsilon)
+                else:
+                    params, v, s = updateParamsAdam(
+                        params, grads, v, s, t, learningRate, beta1, beta2, epsilon
+                    )
+
+            if profile:
+                timer.samples += batchData.shape[1]
+
+        # Record the final cost of a trial that blew up and stop
+        if stopReason == "nan":
+            descendingGraph = False
+            costs.append(cost)
+            break
 
-        # Print the cost every N number of iterations
-        if printCost and i % 500 == 0:
-            print("Cost after iteration", str(i), "is", str(cost))
+        # Cost of the whole training set with the updated params
+        if logged and evalCost:
+            with timer.phase("Cost"):
+                cost = Predictor(params, dtype=dtype).cost(data, labels, lamb)
 
-        # Record the cost every N number of iterations
-        if i % 50 == 0:
-            if (len(costs) != 0) and (cost > costs[-1]):
-                descendingGraph = False
-            costs.append(cost)
+        with timer.phase("Record"):
+            # Print the cost every N number of iterations
+            if printCost and i % 500 == 0:
+                print("Cost after iteration", str(i), "is", str(cost))
+
+            # Record the cost every N number of iterations
+            if logged:
+                if (len(costs) != 0) and (cost > costs[-1]):
+                    descendingGraph = False
+                costs.append(cost)
+
+                # Check the early stopping rules against the recorded cost
+                if stopper is not None:
+                    stopReason = stopper.check(cost) or "completed"
+
+        if stopReason != "completed":
+            break
+
+    if printCost and stopReason != "completed":
+        print("Stopped early after iteration", str(i), "(" + stopReason + ")")
+
+    if report is not None:
+        report["Stop_Reason"] = stopReason
+        report["Stopped_At"] = i
+        if profile:
+            report.update(timer.summary())
 
     # Print the model training cost graph
     if showGraph:
@@ -684,14 +2646,112 @@ def model(
     return params, costs, descendingGraph
 
 
+# Inference-only forward propogation
+# No dropout and no cache:  the input is pushed through the network 'chunkSize' records at a time, and each layer
+# writes into a buffer that is reused from chunk to chunk, so memory stays bounded for large test sets.
+# Works with in-memory data matrices as well as HDF5Dataset objects.
+class Predictor:
+
+    def __init__(self, params, chunkSize=4096, dtype=None):
+        self.layers = len(params) // 2
+        self.chunkSize = chunkSize
+
+        # Run in the precision of the params unless told otherwise
+        if dtype is None:
+            dtype = params["w1"].dtype
+        self.dtype = np.dtype(dtype)
+        self.w = [np.asarray(params["w" + str(i)], dtype=self.dtype) for i in range(1, self.layers + 1)]
+        self.b = [np.asarray(params["b" + str(i)], dtype=self.dtype) for i in range(1, self.layers + 1)]
+        self.buffers = {}
+
+    # Create (or reuse) the activation buffers for a chunk with 'm' records
+    def getBuffers(self, m):
+        if m not in self.buffers:
+            self.buffers[m] = [np.empty((w.shape[0], m), dtype=self.dtype) for w in self.w]
+        return self.buffers[m]
+
+    # Push a single (features, m) chunk through the network; returns the output layer's buffer
+    # With 'logits' set the output layer's sigmoid is skipped
+    def forwardChunk(self, chunk, logits=False):
+        a = chunk
+        for i, buffer in enumerate(self.getBuffers(chunk.shape[1])):
+            np.matmul(self.w[i], a, out=buffer)
+            buffer += self.b[i]
+
+            if i == self.layers - 1 and logits:
+                pass
+            elif i == self.layers - 1:
+                # Last layer; sigmoid activation
+                np.negative(buffer, out=buffer)
+                np.exp(buffer, out=buffer)
+                buffer += 1
+                np.reciprocal(buffer, out=buffer)
+            else:
+                # Hidden layer; ReLu activation
+                np.maximum(buffer, 0, out=buffer)
+            a = buffer
+
+        return a
+
+    # Yield the (features, n) input chunks of an in-memory matrix or an HDF5Dataset
+    def chunks(self, data):
+        if isinstance(data, HDF5Dataset):
+            raw = np.empty((self.chunkSize,) + data.data.shape[1:], dtype=data.data.dtype)
+            normalized = np.empty((data.features, self.chunkSize), dtype=self.dtype)
+            for start in range(0, data.m, self.chunkSize):
+                stop = min(start + self.chunkSize, data.m)
+                chunk = normalized[:, : stop - start]
+                np.divide(data.readRaw(start, stop, raw).T, 255., out=chunk)
+                yield chunk
+        else:
+            for start in range(0, data.shape[1], self.chunkSize):
+                yield data[:, start : start + self.chunkSize]
+
+    # Return the (1, m) output probabilities for every record
+    def probabilities(self, data):
+        m = data.m if isinstance(data, HDF5Dataset) else data.shape[1]
+        probs = np.empty((self.w[-1].shape[0], m), dtype=self.dtype)
+
+        start = 0
+        for chunk in self.chunks(data):
+            stop = start + chunk.shape[1]
+            probs[:, start:stop] = self.forwardChunk(chunk)
+            start = stop
+
+        return probs
+
+    # Calculate the cost over every record (includes L2 regularization) with no dropout
+    # Uses the same logit space cross entropy as FusedNetwork.cost(), one chunk at a time
+    def cost(self, data, labels, lamb):
+        crossEntropySum = 0
+        start = 0
+
+        for chunk in self.chunks(data):
+            stop = start + chunk.shape[1]
+            z = self.forwardChunk(chunk, logits=True)
+            crossEntropySum += (
+                np.sum(np.maximum(z, 0))
+                - np.vdot(labels[:, start:stop], z)
+                + np.sum(np.log1p(np.exp(-np.abs(z))))
+            )
+            start = stop
+
+        regSums = sum(np.vdot(w.reshape(-1), w.reshape(-1)) for w in self.w)
+
+        return crossEntropySum / start + (1 / start) * (lamb / 2) * regSums
+
+    # Return the (1, m) predicted labels for every record
+    # Anything with a probability of greater than 0.5 is classified as a 1 (i.e. cat)
+    def labels(self, data):
+        return self.probabilities(data) > 0.5
+
+
 # Utilize the model's trained params to make predictions
-def predict(data, params, trueLabels):
+# 'chunkSize' sets how many records are pushed through the network at a time (see Predictor)
+def predict(data, params, trueLabels, chunkSize=4096):
     # Apply the training weights and the sigmoid activation to the inputs
-    cache = forwardPropagation(data, params, 1)
-    aL = cache["a" + str((len(params)) // 2)]
-
     # Classify anything with a probability of greater than 0.5 to a 1 (i.e. cat) classification
-    predictions = aL > 0.5
+    predictions = Predictor(params, chunkSize).labels(data)
     accuracy = 100 - np.mean(np.abs(predictions - trueLabels)) * 100
 
     preds = {"predictions": predictions, "accuracy": accuracy}